@@ -0,0 +1,246 @@
+import asyncio
+import os
+import time
+import aiohttp
+from config import env_float
+from utils import parse_retry_after
+from http_client import create_session, telegram_url
+
+TELEGRAM_MAX_LENGTH = 4096
+ALERT_SEPARATOR = "\n\n➖➖➖➖➖\n\n"
+
+
+class TelegramError(Exception):
+    """Telegram refused a message"""
+
+    def __init__(self, status, text="", retry_after=None):
+        super().__init__(f"{status} - {text}")
+        self.status = status
+        self.text = text
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self):
+        return self.status == 429 or self.status >= 500
+
+
+def split_message(message, max_length=TELEGRAM_MAX_LENGTH):
+    """Split an over-long alert at line breaks, so a Markdown entity is not cut in half
+
+    Only a single line longer than `max_length` is cut mid-line.
+    """
+    if len(message) <= max_length:
+        return [message]
+    parts = []
+    lines = []
+    length = -1
+    for line in message.split("\n"):
+        while len(line) > max_length:
+            if lines:
+                parts.append("\n".join(lines))
+                lines, length = [], -1
+            parts.append(line[:max_length])
+            line = line[max_length:]
+        if lines and length + 1 + len(line) > max_length:
+            parts.append("\n".join(lines))
+            lines, length = [], -1
+        lines.append(line)
+        length += 1 + len(line)
+    if lines:
+        parts.append("\n".join(lines))
+    return parts
+
+
+def coalesce(messages, max_length=TELEGRAM_MAX_LENGTH):
+    """Group queued alerts (each at most `max_length` long) into as few Telegram messages as fit the size limit"""
+    groups = []
+    length = 0
+    for message in messages:
+        if groups and length + len(ALERT_SEPARATOR) + len(message) <= max_length:
+            groups[-1].append(message)
+            length += len(ALERT_SEPARATOR) + len(message)
+        else:
+            groups.append([message])
+            length = len(message)
+    return groups
+
+
+class AlertDispatcher:
+    """Background sender for Telegram alerts
+
+    submit() only queues the alert, so the scoring path never waits on
+    Telegram. A sender task drains the queue over its own pooled aiohttp
+    session: alerts arriving within `coalesce_window` seconds are merged
+    into one message, messages to the chat are spaced by `min_interval`
+    seconds, and 429/5xx answers or network errors are retried with
+    exponential backoff (honouring Telegram's retry_after).
+
+    A custom `sender` (an async callable taking the text) replaces the
+    Telegram API call, e.g. to route alerts elsewhere. `session` shares
+    the bot's pooled session instead of opening one.
+    """
+
+    def __init__(self, log_message, sender=None, token=None, chat_id=None,
+                 min_interval=None, coalesce_window=None, max_retries=5, session=None):
+        self.log_message = log_message
+        self.sender = sender
+        self.token = token or os.getenv("TELEGRAM_BOT_TOKEN")
+        self.chat_id = chat_id or os.getenv("TELEGRAM_USER_ID")
+        self.min_interval = min_interval if min_interval is not None else env_float("TELEGRAM_MIN_INTERVAL", 1.0)
+        self.coalesce_window = coalesce_window if coalesce_window is not None else env_float("ALERT_COALESCE_WINDOW", 1.0)
+        self.max_retries = max_retries
+        self.queue = asyncio.Queue()
+        self.session = session
+        self._own_session = False
+        self.task = None
+        self._last_sent = 0.0
+        # Alerts taken off the queue by the sender and not yet delivered or given up on
+        self.in_flight = 0
+        # Stats
+        self.queued = 0
+        self.sent = 0
+        self.messages = 0
+        self.retries = 0
+        self.failed = 0
+
+    def start(self):
+        if self.sender is None and self.session is None:
+            self.session = create_session(limit_per_host=2)
+            self._own_session = True
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    def submit(self, message, on_sent=None):
+        """Queue an alert and return immediately
+
+        `on_sent`, if given, is called with the wall-clock time the alert
+        was delivered.
+        """
+        self.queue.put_nowait((message, on_sent))
+        self.queued += 1
+
+    async def _run(self):
+        while True:
+            pending = [await self.queue.get()]
+            self.in_flight = 1
+            if self.coalesce_window > 0:
+                await asyncio.sleep(self.coalesce_window)
+            while not self.queue.empty():
+                pending.append(self.queue.get_nowait())
+            self.in_flight = len(pending)
+            parts = [(number, part) for number, (message, _) in enumerate(pending) for part in split_message(message)]
+            last_part = {number: position for position, (number, _) in enumerate(parts)}
+            # coalesce() keeps the order, so each group is the next len(group) parts
+            position = 0
+            for group in coalesce([part for _, part in parts]):
+                numbers = dict.fromkeys(number for number, _ in parts[position:position + len(group)])
+                position += len(group)
+                # Alerts whose last part goes out with this group
+                finished = [number for number in numbers if last_part[number] < position]
+                delivered = await self._deliver(ALERT_SEPARATOR.join(group))
+                self.in_flight -= len(finished)
+                if delivered:
+                    self.sent += len(finished)
+                    sent_at = time.time()
+                    for number in finished:
+                        on_sent = pending[number][1]
+                        if on_sent is None:
+                            continue
+                        try:
+                            on_sent(sent_at)
+                        except Exception as e:
+                            self.log_message(f"❌ Alert callback error: {e}")
+            self.in_flight = 0
+            for _ in pending:
+                self.queue.task_done()
+
+    async def _deliver(self, text):
+        """Send one message, retrying transient failures with backoff"""
+        backoff = 1.0
+        for attempt in range(self.max_retries + 1):
+            wait = self._last_sent + self.min_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._last_sent = time.monotonic()
+            try:
+                if self.sender is not None:
+                    await self.sender(text)
+                else:
+                    await self._post(text)
+                self.messages += 1
+                self.log_message("✅ Telegram alert sent successfully")
+                return True
+            except TelegramError as e:
+                if not e.retryable or attempt == self.max_retries:
+                    self.failed += 1
+                    self.log_message(f"❌ Telegram send failed: {e}")
+                    return False
+                delay = e.retry_after if e.retry_after is not None else backoff
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == self.max_retries:
+                    self.failed += 1
+                    self.log_message(f"❌ Telegram alert error: {e}")
+                    return False
+                delay = backoff
+            except Exception as e:
+                self.failed += 1
+                self.log_message(f"❌ Telegram alert error: {e}")
+                return False
+            self.retries += 1
+            self.log_message(f"⏳ Telegram alert retry in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            backoff = min(backoff * 2, 60.0)
+        return False
+
+    async def _post(self, text):
+        if not self.token or not self.chat_id:
+            raise TelegramError(0, "Telegram token or user ID is missing.")
+        data = {
+            "chat_id": self.chat_id,
+            "text": text,
+            "parse_mode": "Markdown",
+            "disable_web_page_preview": "true"
+        }
+        async with self.session.post(telegram_url(f"/bot{self.token}/sendMessage"), data=data,
+                                     timeout=aiohttp.ClientTimeout(total=15)) as resp:
+            if resp.status == 200:
+                return
+            body = await resp.text()
+            retry_after = parse_retry_after(resp.headers.get("Retry-After"))
+            if retry_after is None and resp.status == 429:
+                try:
+                    retry_after = float((await resp.json(content_type=None))["parameters"]["retry_after"])
+                except (ValueError, KeyError, TypeError):
+                    pass
+            raise TelegramError(resp.status, body, retry_after)
+
+    async def close(self, timeout=10.0):
+        """Flush what is still queued (up to `timeout` seconds), then stop"""
+        if self.task is not None:
+            try:
+                if self.queue.qsize() or self.in_flight:
+                    await asyncio.wait_for(self.queue.join(), timeout)
+            except asyncio.TimeoutError:
+                # Queued alerts plus the batch the sender is still working on
+                dropped = self.queue.qsize() + self.in_flight
+                self.log_message(f"⚠️ Dropped {dropped} unsent alerts on shutdown")
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+        if self._own_session:
+            await self.session.close()
+            self.session = None
+            self._own_session = False
+
+    def stats(self):
+        return {
+            "queued": self.queued,
+            "pending": self.queue.qsize() + self.in_flight,
+            "sent": self.sent,
+            "messages": self.messages,
+            "retries": self.retries,
+            "failed": self.failed,
+        }
@@ -0,0 +1,259 @@
+import argparse
+import asyncio
+import aiohttp
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from bot_core import CollectionMonitor, collect_metrics
+from alerts import AlertDispatcher
+from dedup import DedupStore
+from http_client import create_session, http_stats
+from latency import LATENCY, format_latency, latency_stats
+from logs import start_logging, stop_logging
+from metadata_cache import MetadataCache
+from rarity import TABLE_COVERAGE
+from replay import Recording, ReplayServer, synthesize
+from scheduler import PollScheduler
+from scoring import ScoreThreshold
+from utils import count_traits, metadata_traits, traits_to_map
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run the listing pipeline against a recorded or synthetic OpenSea feed served locally"
+    )
+    parser.add_argument("--recording", help="recording directory (RECORD_DIR of an earlier run); synthetic if omitted")
+    parser.add_argument("--listings", type=int, default=100000, help="synthetic listings (default: 100000)")
+    parser.add_argument("--tokens", type=int, default=10000, help="synthetic collection size (default: 10000)")
+    parser.add_argument("--table-share", type=float, default=0.96,
+                        help="share of tokens already in the rarity table; the rest need metadata. Below 0.95 "
+                             "there are no ranks or percentiles, so relative thresholds never alert (default: 0.96)")
+    parser.add_argument("--threshold", default="top 1%", help="alert threshold (default: top 1%%)")
+    parser.add_argument("--poll", action="store_true",
+                        help="poll the stand-in like the bot does instead of feeding the pipeline directly")
+    parser.add_argument("--release-rate", type=float, default=200,
+                        help="with --poll: listings appearing per second (default: 200)")
+    parser.add_argument("--latency-ms", type=float, default=20, help="stand-in response latency (default: 20)")
+    parser.add_argument("--jitter-ms", type=float, default=10, help="extra random latency up to (default: 10)")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="share of requests answered 429 (default: 0)")
+    parser.add_argument("--timeout-rate", type=float, default=0.0,
+                        help="share of requests that hang past the client timeout (default: 0)")
+    parser.add_argument("--request-rate", type=float, default=1000,
+                        help="OpenSea request budget per second (default: 1000)")
+    parser.add_argument("--tracemalloc", action="store_true", help="also measure the Python heap peak (slower)")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--log-level", default="WARNING", help="bot log level during the run (default: WARNING)")
+    return parser.parse_args(argv)
+
+
+def rarity_table(recording, collection, contract, share):
+    """Traits cache with the counts of the recording and the first `share` of its tokens"""
+    prefix = contract.lower()
+    tokens = {
+        token_id: traits_to_map(metadata_traits(data))
+        for (address, token_id), data in recording.metadata.items() if address == prefix
+    }
+    counts = (recording.traits.get(collection) or {}).get("counts") or count_traits(tokens)
+    supply = ((recording.stats.get(collection) or {}).get("stats") or {}).get("total_supply") or len(tokens)
+    known = dict(list(tokens.items())[:int(len(tokens) * share)])
+    return {"collections": {collection: {"traits": counts, "total_supply": supply, "tokens": known}}}
+
+
+def contract_of(recording, events):
+    """Contract of the listed collection, from the listing links or else the recorded metadata"""
+    for event in events:
+        asset = event.get("asset") or {}
+        if asset.get("contract"):
+            return asset["contract"]
+        parts = (asset.get("opensea_url") or "").rstrip("/").split("/")
+        if len(parts) >= 2 and parts[-2].startswith("0x"):
+            return parts[-2]
+    contracts = Counter(address for address, _ in recording.metadata)
+    return contracts.most_common(1)[0][0] if contracts else ""
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+async def feed_pipeline(monitor, session, alerts, log_message, events):
+    """Push every event straight into the pipeline, stamped as listed now"""
+    monitor.pipeline = monitor.build_pipeline(session, alerts.submit, log_message)
+    monitor.pipeline.start()
+    for event in events:
+        now = time.time()
+        await monitor.pipeline.feed([({**event, "event_timestamp": int(now)}, now)])
+    await monitor.pipeline.join()
+
+
+async def poll_pipeline(monitor, session, alerts, log_message, server, listings):
+    """Run the monitor's own poll loop until every listing was released and polling has caught up
+
+    Listings released before the first poll, or beyond what a poll can
+    page through, are missed just as the bot would miss them.
+    """
+    stop = asyncio.Event()
+    headers = {"accept": "application/json"}
+    task = asyncio.create_task(monitor.run(session, headers, stop, alerts.submit, log_message))
+    await asyncio.sleep(listings / server.release_rate)
+    ingestor = monitor.ingestor
+    # Caught up once two more polls found nothing new
+    polls, events = ingestor.polls, ingestor.events
+    while not task.done():
+        await asyncio.sleep(0.05)
+        if ingestor.events != events:
+            polls, events = ingestor.polls, ingestor.events
+        elif ingestor.polls >= polls + 2:
+            break
+    if monitor.pipeline is not None:
+        await monitor.pipeline.join()
+    stop.set()
+    await task
+
+
+async def run_benchmark(args, log_message, work_dir):
+    """Serve the recording (or a synthetic one written to `work_dir`) and time the pipeline on it"""
+    if args.recording:
+        path = args.recording
+    else:
+        path = synthesize(os.path.join(work_dir, "recording"), tokens=args.tokens, listings=args.listings)
+    recording = Recording.load(path)
+    if not recording.events:
+        raise SystemExit(f"No recorded events in {path}")
+    collection, events = max(recording.events.items(), key=lambda item: len(item[1]))
+    contract = contract_of(recording, events)
+    server = ReplayServer(
+        recording, latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, rate_limit=args.rate_limit,
+        timeout_rate=args.timeout_rate, release_rate=args.release_rate if args.poll else 0
+    )
+    url = await server.start()
+    os.environ["OPENSEA_API_BASE"] = url
+    os.environ["TELEGRAM_API_BASE"] = url
+
+    LATENCY.reset()
+    scheduler = PollScheduler(min_interval=0.05, max_interval=1.0, rate=args.request_rate, burst=args.request_rate)
+    dedup = DedupStore(os.path.join(work_dir, "seen_listings.bin"), max_entries=len(events) + 1)
+    metadata_cache = MetadataCache(os.path.join(work_dir, "metadata_cache.db")).open()
+    monitor = CollectionMonitor(
+        collection, contract, ScoreThreshold.parse(args.threshold),
+        rarity_table(recording, collection, contract, args.table_share), scheduler, dedup, metadata_cache
+    )
+    if args.tracemalloc:
+        tracemalloc.start()
+    rss_before = peak_rss_mb()
+    # Same client timeout as run_bot
+    async with create_session(timeout=aiohttp.ClientTimeout(total=5)) as session:
+        alerts = AlertDispatcher(log_message, token="bench", chat_id="bench", min_interval=0,
+                                 coalesce_window=0.05, session=session)
+        alerts.start()
+        # The stand-in has no collection NFTs listing to index from; the table share stands in for it
+        monitor.start_background(session, log_message, None, crawl=False)
+        ranked = monitor.rarity_index.covers_collection()
+        started = time.perf_counter()
+        try:
+            if args.poll:
+                await poll_pipeline(monitor, session, alerts, log_message, server, len(events))
+            else:
+                await feed_pipeline(monitor, session, alerts, log_message, events)
+            elapsed = time.perf_counter() - started
+        finally:
+            # Alerts still queued when the pipeline is done are sent here
+            await alerts.close(timeout=60)
+            drained = time.perf_counter() - started
+            metrics = collect_metrics([monitor], scheduler, dedup, metadata_cache, alerts)
+            await monitor.close()
+            await server.close()
+    heap_peak = None
+    if args.tracemalloc:
+        heap_peak = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1)
+        tracemalloc.stop()
+    cache_stats = metadata_cache.stats()
+    metadata_cache.close()
+
+    processed = monitor.pipeline.stats()["normalize"]["processed"]
+    return {
+        "recording": args.recording or f"synthetic ({args.tokens} tokens)",
+        "collection": collection,
+        "mode": "poll" if args.poll else "pipeline",
+        "recorded": len(events),
+        "listings": processed,
+        "seconds": round(elapsed, 2),
+        "events_per_second": round(processed / elapsed, 1) if elapsed else None,
+        "drain_seconds": round(drained - elapsed, 2),
+        "total_seconds": round(drained, 2),
+        "ranked_from_start": ranked,
+        "scored": monitor.scored,
+        "scored_locally": monitor.local_scores,
+        "scored_via_metadata": monitor.fetched_scores,
+        "metadata_failures": monitor.metadata_failures,
+        "alerts": alerts.stats(),
+        "latency": latency_stats(),
+        "pipeline": monitor.pipeline.stats(),
+        "ingest": monitor.ingestor.stats(),
+        "scheduler": scheduler.stats(),
+        "metadata_cache": cache_stats,
+        "stand_in": server.served(),
+        "http": http_stats(),
+        "memory": {"peak_rss_mb": peak_rss_mb(), "rss_before_run_mb": rss_before, "heap_peak_mb": heap_peak},
+        "metric_families": len(metrics),
+    }
+
+
+def report(result):
+    lines = [
+        f"📼 {result['recording']} ({result['collection']}, {result['mode']} mode)",
+        f"⚡ {result['listings']} of {result['recorded']} listings in {result['seconds']}s: "
+        f"{result['events_per_second']} events/sec",
+        f"📤 Alerts drained {result['drain_seconds']}s later ({result['total_seconds']}s in all)",
+        f"📊 Scored {result['scored']} (table {result['scored_locally']}, metadata {result['scored_via_metadata']}, "
+        f"{result['metadata_failures']} failed); alerts {result['alerts']['sent']} in {result['alerts']['messages']} messages",
+        f"🌐 Stand-in: {result['stand_in']}",
+    ]
+    if not result["ranked_from_start"]:
+        lines.append(f"⚠️ The rarity table started below {TABLE_COVERAGE:.0%} of the collection: no ranks or "
+                     f"percentiles until listings filled it in, so relative thresholds could not alert until then (raise --table-share)")
+    memory = result["memory"]
+    if memory["peak_rss_mb"] is not None:
+        lines.append(f"🧠 Peak RSS {memory['peak_rss_mb']} MB (before the run {memory['rss_before_run_mb']} MB)")
+    if memory["heap_peak_mb"] is not None:
+        lines.append(f"🧠 Python heap peak during the run {memory['heap_peak_mb']} MB")
+    lines.append("⏱ Latency per step (p50 / p95 / p99):")
+    lines.extend(f"   {line}" for line in format_latency(result["latency"]))
+    lines.append("🔧 Pipeline:")
+    for stage, stats in result["pipeline"].items():
+        lines.append(f"   {stage:<10} {stats}")
+    return lines
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.environ["LOG_LEVEL"] = args.log_level
+    os.environ.setdefault("LOG_FILE", "off")
+    log_message = start_logging()
+    try:
+        with tempfile.TemporaryDirectory(prefix="nft_bench_") as work_dir:
+            result = asyncio.run(run_benchmark(args, log_message, work_dir))
+    finally:
+        stop_logging()
+    for line in report(result):
+        print(line)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,40 @@
 import asyncio
 import aiohttp
 import os
+import sqlite3
+import threading
+import time
 import traceback
 from datetime import datetime
 from dotenv import load_dotenv
+from traits_store import ANY_COLLECTION
 from utils import (
     send_telegram_alert,
-    fetch_metadata,
-    load_traits_cache,
-    save_traits_cache,
-    calculate_rarity_score
+    fetch_metadata_async,
+    crawl_collection,
+    crawl_checkpoint_path,
+    collection_cache,
+    fetch_collection_stats_async,
+    fetch_collection_traits_async,
+    metadata_traits,
+    traits_to_map,
+    open_traits_store
 )
+from ingest import EventIngestor, ApiError, event_timestamp
+from scheduler import PollScheduler
+from config import env_float, env_int
+from rarity import RarityIndex
+from scoring import DEFAULT_FORMULA, ScoreThreshold, make_engine
+from dedup import DedupStore, listing_key, parse_wei
+from alerts import AlertDispatcher
+from metadata_cache import MetadataCache
+from market import MarketState
+from http_client import create_session, http_stats
+from logs import start_logging, stop_logging
+from latency import LATENCY, format_latency, latency_stats
+from metrics import MetricsServer
+from pipeline import Listing, Pipeline, Stage
+from replay import RECORDER, start_recording
 
 load_dotenv()
 
@@ -19,6 +43,9 @@ CONTRACT_ADDRESS = os.getenv("CONTRACT_ADDRESS")
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 TELEGRAM_USER_ID = os.getenv("TELEGRAM_USER_ID")
 OPENSEA_API_KEY = os.getenv("OPENSEA_API_KEY")
+SCORING_MODEL = os.getenv("SCORING_MODEL", DEFAULT_FORMULA)
+# Used instead of COLLECTION_THRESHOLDS by models whose scores are on another scale
+DEFAULT_PERCENTILE_THRESHOLD = ScoreThreshold(95.0, percentile=True)
 
 # Collection-specific score thresholds
 COLLECTION_THRESHOLDS = {
@@ -80,22 +107,75 @@ def get_score_threshold(collection_slug):
     # Return default if no match found
     return COLLECTION_THRESHOLDS["default"]
 
-TOTAL_SUPPLY = 4269
+def resolve_score_threshold(collection_slug, explicit=None, model=None):
+    """Threshold for a collection: explicit value, then MIN_SCORE_THRESHOLD, then the table
 
-def log_message(message):
-    """Print timestamped log message"""
-    timestamp = datetime.now().strftime("%H:%M:%S")
-    print(f"[{timestamp}] {message}")
+    Thresholds are ScoreThresholds: absolute scores, percentiles ("95%",
+    "top 5%") or ranks ("top 100").
+    The table holds absolute scores of the original model, so other
+    models fall back to DEFAULT_PERCENTILE_THRESHOLD instead.
+    """
+    if explicit is not None:
+        return ScoreThreshold.parse(explicit)
+    # Get threshold from environment or use collection-specific default
+    env_threshold = ScoreThreshold.parse(os.getenv("MIN_SCORE_THRESHOLD") or "")
+    if env_threshold is not None:
+        return env_threshold
+    if (model or SCORING_MODEL).strip().lower() != DEFAULT_FORMULA:
+        return DEFAULT_PERCENTILE_THRESHOLD
+    return ScoreThreshold(get_score_threshold(collection_slug))
+
+def load_collections():
+    """Collections to monitor as (slug, contract_address, threshold) tuples
+
+    COLLECTIONS=slug:0xcontract[:threshold],... lists several collections;
+    without it the single COLLECTION_SLUG/CONTRACT_ADDRESS pair is used.
+    """
+    collections = []
+    for item in os.getenv("COLLECTIONS", "").split(","):
+        parts = [part.strip() for part in item.split(":")]
+        if len(parts) < 2 or not parts[0] or not parts[1]:
+            continue
+        threshold = None
+        if len(parts) > 2 and parts[2]:
+            threshold = ScoreThreshold.parse(parts[2])
+        collections.append((parts[0], parts[1], resolve_score_threshold(parts[0], threshold)))
+    if not collections and COLLECTION_SLUG and CONTRACT_ADDRESS:
+        collections.append((COLLECTION_SLUG, CONTRACT_ADDRESS, resolve_score_threshold(COLLECTION_SLUG)))
+    return collections
+
+# Maximum number of metadata requests in flight for one page of events
+METADATA_CONCURRENCY = env_int("METADATA_CONCURRENCY", 8, minimum=1)
+
+# Listings each stage of a collection's pipeline may queue before the stage feeding it waits
+PIPELINE_QUEUE_SIZE = env_int("PIPELINE_QUEUE_SIZE", 100, minimum=1)
+
+# Seconds between background refreshes of total supply and trait counts
+CACHE_REFRESH_INTERVAL = env_int("CACHE_REFRESH_INTERVAL", 3600, minimum=60)
+
+# Seconds before a failed traits crawl is resumed (doubles with every failure, up to an hour)
+CRAWL_RETRY_DELAY = env_int("CRAWL_RETRY_DELAY", 60, minimum=1)
+
+# Port of the optional /metrics endpoint (0 disables it)
+METRICS_PORT = env_int("METRICS_PORT", 0)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# Minimum deal score (rarity and price, 0-100) to alert on; 0 alerts on rarity alone
+DEAL_SCORE_THRESHOLD = env_float("DEAL_SCORE_THRESHOLD", 70.0)
+
+# Seconds a stop waits, in all, for queued listings and alerts before cancelling them
+SHUTDOWN_TIMEOUT = env_float("SHUTDOWN_TIMEOUT", 3.0, minimum=0)
 
 def validate_config(log_message):
     """Validate that all required configuration is present"""
     required_vars = {
-        "COLLECTION_SLUG": COLLECTION_SLUG,
-        "CONTRACT_ADDRESS": CONTRACT_ADDRESS,
         "TELEGRAM_BOT_TOKEN": TELEGRAM_BOT_TOKEN,
         "TELEGRAM_USER_ID": TELEGRAM_USER_ID,
         "OPENSEA_API_KEY": OPENSEA_API_KEY
     }
+    if not load_collections():
+        required_vars["COLLECTION_SLUG"] = COLLECTION_SLUG
+        required_vars["CONTRACT_ADDRESS"] = CONTRACT_ADDRESS
     
     missing = [key for key, value in required_vars.items() if not value]
     
@@ -104,145 +184,748 @@ def validate_config(log_message):
         log_message("Please check your .env file and restart the bot.")
         return False
     
+    try:
+        make_engine(SCORING_MODEL)
+    except ValueError as e:
+        log_message(f"❌ {e}")
+        return False
+
+    # Absolute scores are on the scale of the default model only
+    if SCORING_MODEL.strip().lower() != DEFAULT_FORMULA:
+        absolute = [f"{slug} ({threshold})" for slug, _, threshold in load_collections() if not threshold.relative]
+        if absolute:
+            log_message(
+                f"❌ Absolute score thresholds only work with SCORING_MODEL={DEFAULT_FORMULA}: {', '.join(absolute)}. "
+                f"With SCORING_MODEL={SCORING_MODEL} use a percentile or rank, e.g. MIN_SCORE_THRESHOLD=95% or top 100."
+            )
+            return False
+
     log_message("✅ All configuration validated successfully")
-    # Get threshold from environment or use collection-specific default
-    env_threshold = os.getenv("MIN_SCORE_THRESHOLD")
-    if env_threshold:
+    log_message(f"🧮 Scoring model: {SCORING_MODEL}")
+    if DEAL_SCORE_THRESHOLD > 0:
+        log_message(f"💹 Alerting on NFTs passing the score threshold with a deal score >= {DEAL_SCORE_THRESHOLD:g}")
+    for slug, _, threshold in load_collections():
+        log_message(f"🎯 Using score threshold for {slug}: {threshold}")
+    return True
+
+class StopEvent(threading.Event):
+    """threading.Event that also wakes asyncio loops waiting on it
+
+    Loops call attach() to get an asyncio.Event; set() from any thread
+    (GUI button, signal handler) hands it to each loop through
+    call_soon_threadsafe, so waiting for a stop costs no polling.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._waiters_lock = threading.Lock()
+        self._waiters = []
+
+    def attach(self, loop=None):
+        loop = loop or asyncio.get_running_loop()
+        async_event = asyncio.Event()
+        with self._waiters_lock:
+            if self.is_set():
+                async_event.set()
+            else:
+                self._waiters.append((loop, async_event))
+        return async_event
+
+    def set(self):
+        with self._waiters_lock:
+            super().set()
+            waiters, self._waiters = self._waiters, []
+        for loop, async_event in waiters:
+            try:
+                loop.call_soon_threadsafe(async_event.set)
+            except RuntimeError:
+                pass  # Loop already closed
+
+def bridge_stop_event(stop_event):
+    """Return an asyncio.Event for the running loop that is set with stop_event"""
+    if hasattr(stop_event, "attach"):
+        return stop_event.attach()
+    # Plain threading.Event: block a daemon thread on it instead of polling
+    loop = asyncio.get_running_loop()
+    async_event = asyncio.Event()
+
+    def wait_for_stop():
+        stop_event.wait()
         try:
-            min_score_threshold = int(env_threshold)
-        except ValueError:
-            min_score_threshold = get_score_threshold(COLLECTION_SLUG)
-    else:
-        min_score_threshold = get_score_threshold(COLLECTION_SLUG)
-    log_message(f"🎯 Using score threshold: {min_score_threshold}")
+            loop.call_soon_threadsafe(async_event.set)
+        except RuntimeError:
+            pass
+
+    threading.Thread(target=wait_for_stop, daemon=True).start()
+    return async_event
+
+async def responsive_sleep(seconds, stop, log_message):
+    """Sleep up to `seconds`; return True as soon as `stop` is set"""
+    try:
+        await asyncio.wait_for(stop.wait(), timeout=seconds)
+    except asyncio.TimeoutError:
+        return False
+    log_message("🛑 Bot stopped gracefully (during sleep).")
     return True
 
-async def responsive_sleep(seconds, stop_event, log_message):
-    interval = 0.05  # Reduced from 0.1s to 0.05s for faster response
-    steps = int(seconds / interval)
-    for _ in range(steps):
-        if stop_event.is_set():
-            log_message("🛑 Bot stopped gracefully (during sleep).")
-            return True
-        await asyncio.sleep(interval)
-    return False
+async def until_stopped(awaitable, stop):
+    """Await `awaitable`, cancelling it as soon as `stop` is set
 
-async def run_bot(log_message, send_alert, stop_event):
+    Raises asyncio.CancelledError when the stop won the race.
+    """
+    task = asyncio.ensure_future(awaitable)
+    stopper = asyncio.ensure_future(stop.wait())
     try:
-        print("[DEBUG] run_bot started")
-        log_message("[DEBUG] run_bot started, about to load traits cache and validate config.")
-        seen = set()
-        traits_cache = load_traits_cache()
-        log_message("[DEBUG] Traits cache loaded.")
-        if not validate_config(log_message):
-            log_message("[DEBUG] Config validation failed.")
+        await asyncio.wait({task, stopper}, return_when=asyncio.FIRST_COMPLETED)
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    finally:
+        stopper.cancel()
+    if not task.done():
+        task.cancel()
+        try:
+            await task
+        except BaseException:
+            pass
+        raise asyncio.CancelledError()
+    return task.result()
+
+async def fetch_listing_metadata(session, token_id, contract_address, scheduler=None, cache=None):
+    """Metadata of one listed token, from `cache` (a MetadataCache) when it has it
+
+    Fetched traits are added to the cache. A token without traits (not
+    revealed or not indexed by OpenSea yet) is not cached, so it is asked
+    for again next time instead of scoring 0 until the entry expires.
+    """
+    if cache is not None:
+        metadata = cache.get(contract_address, token_id)
+        if metadata is not None and metadata.get("traits"):
+            return metadata
+    metadata = await fetch_metadata_async(session, token_id, contract_address, scheduler)
+    if metadata and cache is not None:
+        metadata = {"traits": metadata_traits(metadata)}
+        if metadata["traits"]:
+            cache.put(contract_address, token_id, metadata)
+    return metadata
+
+async def refresh_rarity_data(session, collection_slug, get_index, on_change, log_message,
+                              scheduler=None, interval=None, on_stats=None):
+    """Keep a collection's total supply and trait counts current, forever
+
+    Meant to run as a background task. `get_index` returns the live
+    RarityIndex, which is updated in place; `on_change(index, count_changes)`
+    is called after anything changed, with only the trait counts that
+    changed, so the cache can be persisted incrementally. `on_stats`, if
+    given, receives every collection stats response. A failed refresh is
+    logged and retried with backoff (up to `interval`).
+    """
+    interval = interval or CACHE_REFRESH_INTERVAL
+    failures = 0
+    while True:
+        try:
+            stats = await fetch_collection_stats_async(session, collection_slug, scheduler)
+            if stats and on_stats:
+                on_stats(stats)
+            supply = ((stats or {}).get("stats") or {}).get("total_supply")
+            counts = await fetch_collection_traits_async(session, collection_slug, scheduler)
+            index = get_index()
+            changed = False
+            if supply and int(supply) != index.total_supply:
+                log_message(f"📏 Total supply of {collection_slug}: {index.total_supply} -> {int(supply)}")
+                index.set_total_supply(int(supply))
+                changed = True
+            count_changes = index.count_changes(counts) if counts else {}
+            if count_changes:
+                updated = index.update_counts(count_changes)
+                log_message(f"🧬 {updated} trait counts of {collection_slug} changed")
+                changed = True
+            if changed:
+                on_change(index, count_changes)
+            failures = 0
+            delay = interval
+        except Exception as e:
+            failures += 1
+            delay = min(interval, CRAWL_RETRY_DELAY * 2 ** (failures - 1))
+            log_message(f"❌ Rarity data refresh of {collection_slug} failed: {e} - retrying in {delay}s\n"
+                        f"{traceback.format_exc()}")
+        await asyncio.sleep(delay)
+
+class CollectionMonitor:
+    """Watches the listings of one collection inside the bot's shared session
+
+    Owns the collection's rarity index, events cursor and poll cadence; the
+    session, request budget and seen-listings store are shared with every
+    other monitor.
+    """
+
+    def __init__(self, collection_slug, contract_address, threshold, traits_cache, scheduler, dedup,
+                 metadata_cache=None, tag=""):
+        self.collection_slug = collection_slug
+        self.contract_address = contract_address
+        self.threshold = threshold
+        self.scheduler = scheduler
+        self.tag = tag
+        self.rarity_index = RarityIndex.from_cache(
+            collection_cache(traits_cache, collection_slug), engine=make_engine(SCORING_MODEL)
+        )
+        self.ingestor = EventIngestor(collection_slug, scheduler=scheduler)
+        self.cadence = scheduler.cadence()
+        self.dedup = dedup
+        self.metadata_cache = metadata_cache
+        self.market = MarketState()
+        # Stats
+        self.local_scores = 0
+        self.fetched_scores = 0
+        self.scored = 0
+        self.metadata_failures = 0
+        self.crawl_task = None
+        self.crawl_failures = 0
+        self.crawl_retry_at = None
+        self.session = None
+        self.refresh_task = None
+        self.store = None
+        self.warned_no_table = False
+        self.pipeline = None
+        # Tokens scored since the last flush that are not in the token table yet
+        self.new_tokens = {}
+
+    def start_background(self, session, log_message, store, crawl=True):
+        """Start indexing (if needed, unless `crawl` is False) and the periodic supply/traits refresh
+
+        Changes to the collection's traits cache entry are persisted
+        through `store` (a TraitsCacheStore).
+        """
+        self.store = store
+        self.session = session
+        if not crawl:
+            log_message.debug("%sIndexing disabled; scoring with the token table as loaded", self.tag)
+        elif os.path.exists(crawl_checkpoint_path(self.collection_slug)):
+            log_message(f"{self.tag}🔧 Resuming the interrupted indexing of the collection in the background")
+            self.start_crawl()
+        elif not self.rarity_index.covers_collection():
+            log_message(f"{self.tag}🔧 The token table does not cover the collection yet - indexing it in the background")
+            self.start_crawl()
+
+        def save_rarity_data(index, count_changes):
+            self.persist(log_message, fields={
+                "total_supply": index.total_supply,
+                "supply_updated_at": int(datetime.now().timestamp()),
+            }, counts=count_changes)
+
+        self.refresh_task = asyncio.create_task(refresh_rarity_data(
+            session, self.collection_slug, lambda: self.rarity_index, save_rarity_data,
+            log_message, self.scheduler, on_stats=self.market.seed_floor
+        ))
+
+    def persist(self, log_message, fields=None, counts=None, tokens=None):
+        """Journal a change of the collection's traits cache entry"""
+        if self.store is None:
             return
-        OPENSEA_EVENTS = "https://api.opensea.io/api/v2/events"
-        params = {
-            "event_type": "item_listed",
-            "collection_slug": COLLECTION_SLUG,
-            "limit": 25
-        }
-        headers = {"accept": "application/json"}
-        if OPENSEA_API_KEY:
-            headers["X-API-KEY"] = OPENSEA_API_KEY
-        log_message("🚀 NFT Sniper Bot starting...")
-        log_message(f"📊 Monitoring collection: {COLLECTION_SLUG}")
-        log_message(f"🎯 Contract address: {CONTRACT_ADDRESS}")
-        # Get threshold from environment or use collection-specific default
-        env_threshold = os.getenv("MIN_SCORE_THRESHOLD")
-        if env_threshold:
+        try:
+            if self.store.update(self.collection_slug, fields, counts, tokens):
+                log_message(f"{self.tag}🗜 Compacting the traits cache")
+        except OSError as e:
+            log_message(f"{self.tag}❌ Error saving traits cache update: {e}")
+
+    def start_crawl(self):
+        self.crawl_retry_at = None
+        self.crawl_task = asyncio.create_task(crawl_collection(
+            self.session, self.collection_slug, self.contract_address, scheduler=self.scheduler
+        ))
+
+    def check_crawl(self, log_message):
+        """Swap in the rarity index once a background crawl has finished
+
+        A crawl that failed is started again from its checkpoint after
+        CRAWL_RETRY_DELAY seconds, doubling with every failure up to an hour.
+        """
+        if self.crawl_task is None:
+            if self.crawl_retry_at is not None and time.monotonic() >= self.crawl_retry_at:
+                log_message(f"{self.tag}🔁 Resuming traits indexing (attempt {self.crawl_failures + 1})")
+                self.start_crawl()
+            return
+        if not self.crawl_task.done():
+            return
+        entry = None
+        if not self.crawl_task.cancelled() and self.crawl_task.exception():
+            log_message(f"{self.tag}❌ Traits indexing failed: {self.crawl_task.exception()}")
+        elif not self.crawl_task.cancelled():
+            entry = self.crawl_task.result()
+        self.crawl_task = None
+        if not entry:
+            self.crawl_failures += 1
+            delay = min(CRAWL_RETRY_DELAY * 2 ** (self.crawl_failures - 1), 3600)
+            self.crawl_retry_at = time.monotonic() + delay
+            log_message(f"{self.tag}⏳ Traits indexing will resume in {delay:.0f}s")
+            return
+        self.crawl_failures = 0
+        if self.store is not None:
             try:
-                MIN_SCORE_THRESHOLD = int(env_threshold)
-            except ValueError:
-                MIN_SCORE_THRESHOLD = get_score_threshold(COLLECTION_SLUG)
+                self.store.replace(self.collection_slug, entry)
+                log_message(f"{self.tag}💾 Saving the new traits cache")
+            except OSError as e:
+                log_message(f"{self.tag}❌ Error saving traits cache: {e}")
+        self.rarity_index = RarityIndex.from_cache(entry, engine=make_engine(SCORING_MODEL))
+        log_message(
+            f"{self.tag}🧬 Rarity index rebuilt: {len(self.rarity_index)} trait values, "
+            f"{self.rarity_index.token_count()} tokens"
+        )
+
+    async def close(self, timeout=None):
+        """Stop the pipeline (letting queued listings finish for up to `timeout` seconds) and background tasks"""
+        if self.pipeline is not None:
+            await self.pipeline.close(SHUTDOWN_TIMEOUT if timeout is None else timeout)
+        for task in (self.crawl_task, self.refresh_task):
+            if task and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except BaseException:
+                    pass
+
+    def local_traits(self, token_id, asset):
+        """Traits to score a listing with, without a metadata request
+
+        An empty list when the token is already in the rarity table (its
+        score is a lookup), the traits embedded in the event's asset when
+        present, else None.
+        """
+        if self.rarity_index.lookup(token_id) is not None:
+            return []
+        traits = metadata_traits(asset)
+        return traits or None
+
+    def build_pipeline(self, session, send_alert, log_message):
+        """Listing pipeline: normalize -> dedup -> enrich -> score -> notify
+
+        The poll loop feeds raw events in. Enrichment runs up to
+        METADATA_CONCURRENCY metadata requests at once; every queue holds
+        at most PIPELINE_QUEUE_SIZE listings, so a backlog further down
+        eventually slows polling instead of growing without bound.
+        """
+        return Pipeline([
+            Stage("normalize", self.normalize, maxsize=PIPELINE_QUEUE_SIZE),
+            Stage("dedup", lambda listing: self.deduplicate(listing, log_message),
+                  maxsize=PIPELINE_QUEUE_SIZE, on_idle=self.dedup.maybe_save),
+            Stage("enrich", lambda listing: self.enrich(session, listing),
+                  workers=METADATA_CONCURRENCY, maxsize=PIPELINE_QUEUE_SIZE),
+            Stage("score", lambda listing: self.score_listing(listing, log_message),
+                  maxsize=PIPELINE_QUEUE_SIZE, on_idle=lambda: self.flush_scored(log_message)),
+            Stage("notify", lambda listing: self.notify(listing, send_alert, log_message),
+                  maxsize=PIPELINE_QUEUE_SIZE),
+        ], lambda message: log_message(f"{self.tag}{message}"))
+
+    async def normalize(self, item):
+        """Listing from a raw OpenSea event and the time it was polled (None for anything but a priced listing)"""
+        event, received_at = item
+        if event.get("event_type") != "order":
+            return None
+        if event.get("order_type") != "listing":
+            return None
+        asset = event.get("asset", {})
+        token_id = asset.get("identifier") or asset.get("token_id")
+        name = asset.get("name", f"Token #{token_id}")
+        starting_price = event.get("payment", {}).get("quantity") or event.get("starting_price")
+        price_wei = parse_wei(starting_price)
+        if price_wei is None:
+            return None
+        permalink = asset.get("opensea_url") or asset.get("permalink")
+        return Listing(token_id, name, price_wei, permalink, event.get("order_hash"), event_timestamp(event), asset,
+                       received_at)
+
+    def stamp(self, listing, stage):
+        """Record how long `listing` took to get through `stage` since its previous step"""
+        now = time.time()
+        LATENCY.record(self.collection_slug, stage, now - listing.stamped_at)
+        listing.stamped_at = now
+        return now
+
+    def record_alert_sent(self, listing, sent_at):
+        LATENCY.record(self.collection_slug, "alert", sent_at - listing.stamped_at)
+        if listing.listed_at:
+            LATENCY.record(self.collection_slug, "total", sent_at - listing.listed_at)
+
+    async def deduplicate(self, listing, log_message):
+        key = listing_key(self.collection_slug, listing.order_hash, listing.token_id, listing.price_wei)
+        if not self.dedup.add(key):
+            return None
+        if listing.listed_at:
+            LATENCY.record(self.collection_slug, "received", listing.received_at - listing.listed_at)
+        self.stamp(listing, "dedup")
+        log_message.info("%s🆕 New listing: %s - %.4f ETH", self.tag, listing.name, listing.price_eth)
+        return listing
+
+    async def enrich(self, session, listing):
+        """Attach the traits to score with; only tokens known neither from the
+        token table nor from the event cost a metadata request"""
+        traits = self.local_traits(listing.token_id, listing.asset)
+        if traits is not None:
+            listing.metadata = {"traits": traits}
+            listing.source = "local"
+            self.local_scores += 1
         else:
-            MIN_SCORE_THRESHOLD = get_score_threshold(COLLECTION_SLUG)
-        log_message(f"📈 Minimum score threshold: {MIN_SCORE_THRESHOLD}")
-        log_message("=" * 60)
+            listing.metadata = await fetch_listing_metadata(
+                session, listing.token_id, self.contract_address, self.scheduler, self.metadata_cache
+            )
+            listing.source = "metadata"
+            self.fetched_scores += 1
+        self.stamp(listing, "metadata")
+        return listing
+
+    async def score_listing(self, listing, log_message):
+        """Score a listing and price it against the market; returns it if it should alert"""
+        tag = self.tag
+        token_id = listing.token_id
+        name = listing.name
+        price_eth = listing.price_eth
+        metadata = listing.metadata
+        log_message.debug("%sTraits (%s) available: %s", tag, listing.source, metadata is not None)
+        if not metadata:
+            self.metadata_failures += 1
+            self.market.observe(price_eth, timestamp=listing.listed_at)
+            log_message(f"{tag}⚠️ Could not fetch metadata for {name}")
+            return None
+        traits = metadata.get("traits", [])
+        if traits and self.rarity_index.lookup(token_id) is None:
+            self.new_tokens[token_id] = traits_to_map(traits)
+        score = self.rarity_index.score(token_id, traits)
+        self.scored += 1
+        rank, percentile = self.rarity_index.standing(token_id, score)
+        if self.threshold.relative and rank is None and not self.warned_no_table:
+            self.warned_no_table = True
+            log_message(f"{tag}⚠️ Percentile and rank thresholds need the indexed collection; no alerts until indexing finishes")
+        fields = {"collection": self.collection_slug, "token_id": token_id, "score": score, "rank": rank}
+        if rank is not None:
+            tokens = self.rarity_index.token_count()
+            log_message.info("%s📊 %s - Rarity Score: %s (rank %s of %s, top %.3g%%)",
+                             tag, name, score, rank, tokens, 100 * rank / tokens, extra=fields)
+        else:
+            log_message.info("%s📊 %s - Rarity Score: %s", tag, name, score, extra=fields)
+        # Priced against listings of similar rarity seen before this one
+        deal, reference = self.market.deal(price_eth, percentile)
+        self.market.observe(price_eth, percentile, listing.listed_at)
+        scored_at = self.stamp(listing, "score")
+        if listing.listed_at:
+            LATENCY.record(self.collection_slug, "decision", scored_at - listing.listed_at)
+        if deal is not None:
+            log_message.info("%s💹 %s - Deal Score: %s (%.2fx typical %.4f ETH)", tag, name, deal,
+                             price_eth / reference, reference, extra={**fields, "deal": deal, "price": price_eth})
+        # The rarity threshold always applies; the deal score only narrows it down
+        alert = self.threshold.passes(score, percentile, rank)
+        if alert and DEAL_SCORE_THRESHOLD > 0 and deal is not None:
+            alert = deal >= DEAL_SCORE_THRESHOLD
+        if not alert:
+            return None
+        listing.score = score
+        listing.rank = rank
+        listing.percentile = percentile
+        listing.deal = deal
+        listing.reference = reference
+        return listing
+
+    def flush_scored(self, log_message):
+        """Journal the tokens seen since the last flush, so they score from the table next time"""
+        tokens, self.new_tokens = self.new_tokens, {}
+        self.persist(log_message, tokens=tokens)
+        log_message.debug("%sScored locally: %s, via metadata: %s", self.tag, self.local_scores, self.fetched_scores)
+        if self.fetched_scores and self.metadata_cache is not None and log_message.debug_enabled:
+            log_message.debug("%sMetadata cache: %s", self.tag, self.metadata_cache.stats())
+
+    async def notify(self, listing, send_alert, log_message):
+        name = listing.name
+        price_eth = listing.price_eth
+        rank_line = f"🥇 **Rank:** {listing.rank} of {self.rarity_index.token_count()}\n" if listing.rank is not None else ""
+        floor = self.market.floor()
+        floor_line = f"📉 **Floor:** {floor:.4f} ETH\n" if floor else ""
+        deal_line = ""
+        if listing.deal is not None:
+            deal_line = f"💹 **Deal Score:** {listing.deal} ({price_eth / listing.reference:.2f}x typical {listing.reference:.4f} ETH)\n"
+        if DEAL_SCORE_THRESHOLD > 0 and listing.deal is not None:
+            headline = "💹 **RARE NFT LISTED AS A DEAL!** 💹"
+            reason = f"This NFT meets your rarity criteria and its deal score is at least {DEAL_SCORE_THRESHOLD:g}!"
+        else:
+            headline = "🚨 **HIGH SCORE NFT DETECTED!** 🚨"
+            reason = "This NFT meets your rarity criteria!"
+        alert_message = f"""{headline}\n\n🎯 **Name:** {name}\n🏆 **Rarity Score:** {listing.score}\n{rank_line}💰 **Price:** {price_eth:.4f} ETH\n{floor_line}{deal_line}🔗 **Link:** {listing.permalink}\n\n⚡ **Action Required:** {reason}"""
         try:
-            send_alert("🤖 NFT Sniper Bot is now running and watching listings.")
-            log_message("📱 Telegram alert sent: Bot is active")
+            send_alert(alert_message, on_sent=lambda sent_at: self.record_alert_sent(listing, sent_at))
+            log_message(f"{self.tag}🚨 ALERT QUEUED: {name} (Score: {listing.score})")
         except Exception as e:
-            log_message(f"⚠️ Failed to send Telegram startup alert: {e}")
-        timeout = aiohttp.ClientTimeout(total=5)  # Reduced from 10s to 5s
-        async with aiohttp.ClientSession(timeout=timeout) as session:
-            while not stop_event.is_set():
+            log_message(f"{self.tag}❌ Failed to send Telegram alert: {e}\n{traceback.format_exc()}")
+        return listing
+
+    async def run(self, session, headers, stop, send_alert, log_message):
+        """Poll listings into the pipeline until `stop` is set"""
+        tag = self.tag
+        ingestor = self.ingestor
+        cadence = self.cadence
+        self.pipeline = self.build_pipeline(session, send_alert, log_message)
+        self.pipeline.start()
+        while not stop.is_set():
+            try:
+                if log_message.debug_enabled:
+                    log_message.debug("%sTop of monitoring loop. Scheduler: %s", tag, cadence.stats())
+                    log_message.debug("%sPipeline queues: %s", tag, self.pipeline.depths())
+                log_message.debug("%s🔍 Checking for new listings...", tag)
+                self.check_crawl(log_message)
+                # Check stop event before network request
+                if stop.is_set():
+                    log_message(f"{tag}🛑 Bot stopped before network request.")
+                    return
                 try:
-                    log_message("[DEBUG] Top of monitoring loop.")
-                    log_message("🔍 Checking for new listings...")
-                    # Check stop event before network request
-                    if stop_event.is_set():
-                        log_message("🛑 Bot stopped before network request.")
-                        return
                     try:
-                        async with session.get(OPENSEA_EVENTS, params=params, headers=headers) as resp:
-                            log_message(f"[DEBUG] OpenSea API status: {resp.status}")
-                            if resp.status != 200:
-                                log_message(f"❌ API request failed: {resp.status} - {await resp.text()}")
-                                if await responsive_sleep(5, stop_event, log_message):  # Reduced from 10s to 5s
-                                    log_message("🛑 Bot stopped after API error.")
-                                    return
-                                continue
-                            data = await resp.json()
-                            log_message(f"📡 Received {len(data.get('asset_events', []))} events")
-                            for event in data.get("asset_events", []):
-                                # Check stop event during event processing
-                                if stop_event.is_set():
-                                    log_message("🛑 Bot stopped during event processing.")
-                                    return
-                                if event.get("event_type") != "order":
-                                    continue
-                                if event.get("order_type") != "listing":
-                                    continue
-                                asset = event.get("asset", {})
-                                token_id = asset.get("identifier") or asset.get("token_id")
-                                name = asset.get("name", f"Token #{token_id}")
-                                starting_price = event.get("payment", {}).get("quantity") or event.get("starting_price")
-                                if starting_price is None:
-                                    continue
-                                price_eth = float(starting_price) / (10 ** 18)
-                                permalink = asset.get("opensea_url") or asset.get("permalink")
-                                listing_id = f"{token_id}_{price_eth}"
-                                if listing_id in seen:
-                                    continue
-                                seen.add(listing_id)
-                                log_message(f"🆕 New listing: {name} - {price_eth:.4f} ETH")
-                                try:
-                                    metadata = fetch_metadata(token_id, CONTRACT_ADDRESS)
-                                    log_message(f"[DEBUG] Metadata fetched: {metadata is not None}")
-                                    if metadata:
-                                        traits = metadata.get("traits", [])
-                                        score = calculate_rarity_score(traits, traits_cache, TOTAL_SUPPLY)
-                                        log_message(f"📊 {name} - Rarity Score: {score}")
-                                        if score >= MIN_SCORE_THRESHOLD:
-                                            alert_message = f"""🚨 **HIGH SCORE NFT DETECTED!** 🚨\n\n🎯 **Name:** {name}\n🏆 **Rarity Score:** {score}\n💰 **Price:** {price_eth:.4f} ETH\n🔗 **Link:** {permalink}\n\n⚡ **Action Required:** This NFT meets your rarity criteria!"""
-                                            try:
-                                                send_alert(alert_message)
-                                                log_message(f"🚨 ALERT SENT: {name} (Score: {score})")
-                                            except Exception as e:
-                                                log_message(f"❌ Failed to send Telegram alert: {e}\n{traceback.format_exc()}")
-                                    else:
-                                        log_message(f"⚠️ Could not fetch metadata for {name}")
-                                except Exception as e:
-                                    log_message(f"❌ Error processing {name}: {e}\n{traceback.format_exc()}")
-                    except asyncio.CancelledError:
-                        log_message("🛑 Network request cancelled (bot stopping).")
-                        return
-                    except asyncio.TimeoutError:
-                        log_message("⏰ Network request timed out.")
-                        if await responsive_sleep(5, stop_event, log_message):
-                            log_message("🛑 Bot stopped after timeout.")
+                        events = await until_stopped(ingestor.poll(session, headers), stop)
+                    except ApiError as e:
+                        log_message(f"{tag}❌ API request failed: {e.status} - {e.text}")
+                        if e.status == 429:
+                            cadence.record_rate_limited(e.retry_after)
+                        else:
+                            cadence.record_error()
+                        if await responsive_sleep(cadence.next_delay(), stop, log_message):
+                            log_message(f"{tag}🛑 Bot stopped after API error.")
                             return
                         continue
-                    if await responsive_sleep(3, stop_event, log_message):  # Reduced from 5s to 3s
-                        log_message("🛑 Bot stopped after sleep.")
-                        return
-                except Exception as e:
-                    log_message(f"❌ Inner loop error: {e}\n{traceback.format_exc()}")
-                    if await responsive_sleep(5, stop_event, log_message):  # Reduced from 10s to 5s
-                        log_message("🛑 Bot stopped after exception.")
+                    if events:
+                        log_message.info("%s📡 Received %d events", tag, len(events))
+                    else:
+                        log_message.debug("%s📡 Received 0 events", tag)
+                    if ingestor.last_pages > 1:
+                        log_message(
+                            f"{tag}📈 Caught up over {ingestor.last_pages} pages "
+                            f"(gap total: {ingestor.gap_events} events in {ingestor.gap_polls} polls)"
+                        )
+                    if ingestor.last_truncated:
+                        log_message(
+                            f"{tag}⚠️ Catch-up reached {ingestor.max_pages} pages; the older listings follow in the next polls"
+                        )
+                    if ingestor.backlog:
+                        log_message.debug("%s📈 Catch-up backlog: %d unfinished (%d listings recovered so far)",
+                                          tag, len(ingestor.backlog), ingestor.backlog_events)
+                    cadence.record_poll(len(events), ingestor.page_size)
+                    # Only waits when the pipeline is backed up all the way to its first queue
+                    received_at = time.time()
+                    await until_stopped(self.pipeline.feed([(event, received_at) for event in events]), stop)
+                except asyncio.CancelledError:
+                    log_message(f"{tag}🛑 Network request cancelled (bot stopping).")
+                    return
+                except asyncio.TimeoutError:
+                    log_message(f"{tag}⏰ Network request timed out.")
+                    cadence.record_error()
+                    if await responsive_sleep(cadence.next_delay(), stop, log_message):
+                        log_message(f"{tag}🛑 Bot stopped after timeout.")
                         return
+                    continue
+                if await responsive_sleep(cadence.next_delay(), stop, log_message):
+                    log_message(f"{tag}🛑 Bot stopped after sleep.")
+                    return
+            except Exception as e:
+                log_message(f"{tag}❌ Inner loop error: {e}\n{traceback.format_exc()}")
+                cadence.record_error()
+                if await responsive_sleep(cadence.next_delay(), stop, log_message):
+                    log_message(f"{tag}🛑 Bot stopped after exception.")
+                    return
+
+def alert_dispatcher(send_alert, log_message, session=None):
+    """Dispatcher for run_bot's send_alert
+
+    None or send_telegram_alert use the async Telegram sender (over
+    `session` when given); any other callable is still queued and
+    coalesced, but called in a worker thread.
+    """
+    if send_alert is None or send_alert is send_telegram_alert:
+        return AlertDispatcher(log_message, session=session)
+
+    async def sender(text):
+        if await asyncio.to_thread(send_alert, text) is False:
+            raise RuntimeError("send_alert reported a failure")
+    return AlertDispatcher(log_message, sender=sender, min_interval=0)
+
+def collect_metrics(monitors, scheduler, dedup, metadata_cache, alerts):
+    """Metric families for the /metrics endpoint, read from the live components"""
+    def per_collection(value):
+        return [({"collection": monitor.collection_slug}, value(monitor)) for monitor in monitors]
+
+    def stage_stats(monitor, stage, field):
+        return monitor.pipeline.stats()[stage][field] if monitor.pipeline is not None else 0
+
+    stages, depths, errors = [], [], []
+    for monitor in monitors:
+        if monitor.pipeline is None:
+            continue
+        for stage, stats in monitor.pipeline.stats().items():
+            labels = {"collection": monitor.collection_slug, "stage": stage}
+            depths.append((labels, stats["depth"]))
+            errors.append((labels, stats["errors"]))
+    for collection, steps in latency_stats().items():
+        for stage, summary in steps.items():
+            labels = {"collection": collection, "stage": stage}
+            for quantile, field in (("0.5", "p50_ms"), ("0.95", "p95_ms"), ("0.99", "p99_ms")):
+                stages.append(({**labels, "quantile": quantile}, round(summary[field] / 1000, 4)))
+            stages.append(("_count", labels, summary["count"]))
+            stages.append(("_sum", labels, round(summary["avg_ms"] * summary["count"] / 1000, 3)))
+    scheduler_stats = scheduler.stats()
+    alert_stats = alerts.stats()
+    cache_stats = metadata_cache.stats()
+    http = http_stats()
+    return [
+        ("nft_sniper_polls_total", "counter", "Event polls", per_collection(lambda m: m.ingestor.polls)),
+        ("nft_sniper_events_received_total", "counter", "Listing events received",
+         per_collection(lambda m: m.ingestor.events)),
+        ("nft_sniper_catchup_backlog", "gauge", "Catch-ups left unfinished by the page budget, paged in by later polls",
+         per_collection(lambda m: len(m.ingestor.backlog))),
+        ("nft_sniper_backlog_events_total", "counter", "Listings paged in from an unfinished catch-up",
+         per_collection(lambda m: m.ingestor.backlog_events)),
+        ("nft_sniper_new_listings_total", "counter", "Listings not seen before",
+         per_collection(lambda m: stage_stats(m, "dedup", "processed") - stage_stats(m, "dedup", "dropped"))),
+        ("nft_sniper_dedup_hits_total", "counter", "Listings skipped as already seen",
+         per_collection(lambda m: stage_stats(m, "dedup", "dropped"))),
+        ("nft_sniper_traits_local_total", "counter", "Listings scored without a metadata request",
+         per_collection(lambda m: m.local_scores)),
+        ("nft_sniper_traits_fetched_total", "counter", "Listings that needed a metadata lookup",
+         per_collection(lambda m: m.fetched_scores)),
+        ("nft_sniper_metadata_failures_total", "counter", "Listings whose metadata could not be fetched",
+         per_collection(lambda m: m.metadata_failures)),
+        ("nft_sniper_scores_total", "counter", "Rarity scores computed", per_collection(lambda m: m.scored)),
+        ("nft_sniper_poll_errors_total", "counter", "Failed or timed out polls",
+         per_collection(lambda m: m.cadence.errors)),
+        ("nft_sniper_poll_interval_seconds", "gauge", "Current adaptive poll interval",
+         per_collection(lambda m: round(m.cadence.interval, 3))),
+        ("nft_sniper_floor_eth", "gauge", "Rolling floor price",
+         per_collection(lambda m: m.market.floor())),
+        ("nft_sniper_queue_depth", "gauge", "Listings waiting in a pipeline stage", depths),
+        ("nft_sniper_stage_errors_total", "counter", "Errors raised in a pipeline stage", errors),
+        ("nft_sniper_stage_latency_seconds", "summary", "Time a listing spent reaching each step", stages),
+        ("nft_sniper_opensea_requests_total", "counter", "OpenSea requests made", [({}, scheduler_stats["requests"])]),
+        ("nft_sniper_rate_limited_total", "counter", "429 responses from OpenSea", [({}, scheduler_stats["rate_limited"])]),
+        ("nft_sniper_rate_budget", "gauge", "OpenSea requests available right now", [({}, scheduler_stats["budget"])]),
+        ("nft_sniper_rate_cooldown_seconds", "gauge", "Remaining pause after a 429", [({}, scheduler_stats["cooldown"])]),
+        ("nft_sniper_alerts_sent_total", "counter", "Alerts delivered", [({}, alert_stats["sent"])]),
+        ("nft_sniper_alerts_failed_total", "counter", "Telegram messages given up on", [({}, alert_stats["failed"])]),
+        ("nft_sniper_alert_retries_total", "counter", "Telegram send retries", [({}, alert_stats["retries"])]),
+        ("nft_sniper_alerts_pending", "gauge", "Alerts waiting to be sent", [({}, alert_stats["pending"])]),
+        ("nft_sniper_seen_listings", "gauge", "Listings in the seen set", [({}, len(dedup))]),
+        ("nft_sniper_metadata_cache_hits_total", "counter", "Metadata cache hits", [({}, cache_stats["hits"])]),
+        ("nft_sniper_metadata_cache_misses_total", "counter", "Metadata cache misses", [({}, cache_stats["misses"])]),
+        ("nft_sniper_metadata_cache_hit_ratio", "gauge", "Metadata cache hit ratio", [({}, cache_stats["hit_ratio"])]),
+        ("nft_sniper_http_requests_total", "counter", "HTTP requests per host",
+         [({"host": host}, entry.get("requests", 0)) for host, entry in http.items()]),
+        ("nft_sniper_http_failed_total", "counter", "HTTP requests that failed or got an error status",
+         [({"host": host}, entry.get("failed", 0)) for host, entry in http.items()]),
+        ("nft_sniper_http_connections_total", "counter", "New HTTP connections (handshakes) per host",
+         [({"host": host}, entry.get("connections", 0)) for host, entry in http.items()]),
+    ]
+
+async def run_bot(log_message, send_alert, stop_event):
+    """Run the bot until `stop_event` is set
+
+    `log_message` receives every log line at or above LOG_LEVEL, from a
+    logging thread (see logs.py); lines are also written to LOG_FILE.
+    """
+    log_message = start_logging(log_message)
+    LATENCY.reset()
+    try:
+        stop = bridge_stop_event(stop_event)
+        log_message.debug("run_bot started, about to load traits cache and validate config.")
+        traits_store = open_traits_store()
+        traits_store.on_error = lambda e: log_message(f"❌ Error saving traits cache: {e}")
+        traits_cache = traits_store.cache
+        log_message.debug("Traits cache loaded.")
+        if not validate_config(log_message):
+            log_message.debug("Config validation failed.")
+            return
+        collections = load_collections()
+        if ANY_COLLECTION in traits_cache.get("collections", {}):
+            if len(collections) == 1:
+                traits_store.adopt_legacy(collections[0][0])
+                log_message(f"🧬 Traits cache from before collections were tracked now belongs to {collections[0][0]}")
+            else:
+                log_message("⚠️ Ignoring the traits cache from before collections were tracked: it cannot tell "
+                            "which of the watched collections it belongs to")
+        scheduler = PollScheduler()
+        dedup = DedupStore()
+        log_message(f"🧠 Restored {dedup.load()} seen listings")
+        metadata_cache = MetadataCache()
+        try:
+            metadata_cache.open()
+        except sqlite3.Error as e:
+            log_message(f"⚠️ Metadata cache kept in memory only: {e}")
+        headers = {"accept": "application/json"}
+        if OPENSEA_API_KEY:
+            headers["X-API-KEY"] = OPENSEA_API_KEY
+        log_message("🚀 NFT Sniper Bot starting...")
+        record_dir = start_recording()
+        if record_dir:
+            log_message(f"🎙 Recording OpenSea responses to {record_dir}")
+        monitors = []
+        for slug, contract_address, threshold in collections:
+            tag = f"[{slug}] " if len(collections) > 1 else ""
+            monitor = CollectionMonitor(slug, contract_address, threshold, traits_cache, scheduler, dedup,
+                                        metadata_cache, tag)
+            monitors.append(monitor)
+            log_message(f"📊 Monitoring collection: {slug}")
+            log_message(f"🎯 Contract address: {contract_address}")
+            log_message(f"📈 Minimum score threshold: {threshold}")
+            log_message.debug("Rarity index: %d trait values.", len(monitor.rarity_index))
+        log_message("=" * 60)
+
+        timeout = aiohttp.ClientTimeout(total=5)  # Reduced from 10s to 5s
+        # One pooled session for OpenSea and Telegram
+        async with create_session(timeout=timeout) as session:
+            alerts = alert_dispatcher(send_alert, log_message, session)
+            alerts.start()
+            alerts.submit("🤖 NFT Sniper Bot is now running and watching listings.")
+            log_message("📱 Telegram alert queued: Bot is active")
+            metrics = None
+            if METRICS_PORT > 0:
+                metrics = MetricsServer(
+                    lambda: collect_metrics(monitors, scheduler, dedup, metadata_cache, alerts),
+                    METRICS_PORT, METRICS_HOST
+                )
+                try:
+                    await metrics.start()
+                    log_message(f"📈 Metrics at http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+                except OSError as e:
+                    log_message(f"⚠️ Metrics endpoint not started: {e}")
+                    metrics = None
+            for monitor in monitors:
+                monitor.start_background(session, log_message, traits_store)
+            try:
+                await asyncio.gather(*(
+                    monitor.run(session, headers, stop, alerts.submit, log_message) for monitor in monitors
+                ))
+            finally:
+                if metrics is not None:
+                    await metrics.close()
+                # One deadline for the whole stop: in-flight metadata requests and alerts are cancelled once it passes
+                deadline = time.monotonic() + SHUTDOWN_TIMEOUT
+                await asyncio.gather(*(monitor.close(SHUTDOWN_TIMEOUT) for monitor in monitors))
+                for monitor in monitors:
+                    if log_message.debug_enabled:
+                        log_message.debug("%sMarket: %s", monitor.tag, monitor.market.stats())
+                        if monitor.pipeline is not None:
+                            log_message.debug("%sPipeline: %s", monitor.tag, monitor.pipeline.stats())
+                await alerts.close(timeout=max(0.0, deadline - time.monotonic()))
+                if log_message.debug_enabled:
+                    log_message.debug("Alerts: %s", alerts.stats())
+                try:
+                    dedup.save()
+                except OSError as e:
+                    log_message(f"⚠️ Could not save seen listings: {e}")
+                await traits_store.flush()
+                if log_message.debug_enabled:
+                    log_message.debug("Metadata cache: %s", metadata_cache.stats())
+                    log_message.debug("Traits cache store: %s", traits_store.stats())
+                    log_message.debug("HTTP: %s", http_stats())
+                latency = latency_stats()
+                if latency:
+                    log_message.info("⏱ Listing latency per step (p50 / p95 / p99):", extra={"latency": latency})
+                    for line in format_latency(latency):
+                        log_message.info("⏱ %s", line)
+                metadata_cache.close()
         log_message("🛑 Bot stopped gracefully (end of main loop).")
     except Exception as e:
-        log_message(f"💥 Bot crashed: {e}\n{traceback.format_exc()}") 
\ No newline at end of file
+        log_message(f"💥 Bot crashed: {e}\n{traceback.format_exc()}")
+    finally:
+        RECORDER.stop()
+        stop_logging()
@@ -0,0 +1,25 @@
+import os
+
+
+def env_int(name, default, minimum=None):
+    """Read an integer setting from the environment, falling back to default
+
+    Values below `minimum` are raised to it.
+    """
+    try:
+        value = int(os.getenv(name, default))
+    except ValueError:
+        value = int(default)
+    return value if minimum is None else max(minimum, value)
+
+
+def env_float(name, default, minimum=None):
+    """Read a float setting from the environment, falling back to default
+
+    Values below `minimum` are raised to it.
+    """
+    try:
+        value = float(os.getenv(name, default))
+    except ValueError:
+        value = float(default)
+    return value if minimum is None else max(minimum, value)
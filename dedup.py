@@ -0,0 +1,188 @@
+import hashlib
+import os
+import struct
+import time
+from array import array
+from config import env_int
+
+SEEN_LISTINGS_FILE = "seen_listings.bin"
+SNAPSHOT_MAGIC = b"NFTSEEN1"
+
+
+def parse_wei(quantity):
+    """Listing price as an integer number of wei (None if unparseable)"""
+    if quantity is None:
+        return None
+    try:
+        return int(quantity)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return int(float(quantity))
+    except (TypeError, ValueError):
+        return None
+
+
+def listing_key(collection_slug, order_hash=None, token_id=None, price_wei=None):
+    """64-bit key of a listing: its order hash, else the (token_id, price in wei) pair"""
+    if order_hash:
+        raw = f"{collection_slug}|{order_hash.lower()}"
+    else:
+        raw = f"{collection_slug}|{token_id}|{price_wei}"
+    return int.from_bytes(hashlib.blake2b(raw.encode(), digest_size=8).digest(), "little")
+
+
+class DedupStore:
+    """Bounded set of already processed listings that survives restarts
+
+    Keys are 64-bit hashes kept in a ring of flat arrays (key, time first
+    seen) in insertion order, so both the size cap and the TTL evict from
+    the oldest end in O(1). Lookups go through an open addressing table of
+    ring slots; all of it is about 24-32 bytes per entry, allocated up
+    front. The set is snapshotted to a small binary file and reloaded at
+    startup.
+    """
+
+    def __init__(self, path=SEEN_LISTINGS_FILE, max_entries=None, ttl=None, save_interval=30):
+        self.path = path
+        self.max_entries = max(1, max_entries or env_int("DEDUP_MAX_ENTRIES", 200000))
+        self.ttl = ttl or env_int("DEDUP_TTL", 7 * 24 * 3600)
+        self.save_interval = save_interval
+        self._clear()
+        self._dirty = False
+        self._last_save = time.monotonic()
+        # Stats
+        self.hits = 0
+        self.evicted = 0
+
+    def _clear(self):
+        self._keys = array("Q", [0]) * self.max_entries
+        self._times = array("d", [0.0]) * self.max_entries
+        self._head = 0
+        self._count = 0
+        # At most half full, so probe runs stay short
+        size = 1 << (2 * self.max_entries - 1).bit_length()
+        self._mask = size - 1
+        self._index = array("i", [-1]) * size
+
+    def __len__(self):
+        return self._count
+
+    def _find(self, key):
+        """(table position, ring slot) of a key; the slot is -1 and the position free if absent"""
+        index, keys, mask = self._index, self._keys, self._mask
+        position = key & mask
+        while True:
+            slot = index[position]
+            if slot == -1 or keys[slot] == key:
+                return position, slot
+            position = (position + 1) & mask
+
+    def _unindex(self, position):
+        """Free a table position, moving later entries of its probe run back (linear probing delete)"""
+        index, keys, mask = self._index, self._keys, self._mask
+        following = position
+        while True:
+            index[position] = -1
+            while True:
+                following = (following + 1) & mask
+                slot = index[following]
+                if slot == -1:
+                    return
+                home = keys[slot] & mask
+                # The entry stays put if its home lies cyclically in (position, following]
+                if position < following:
+                    stays = position < home <= following
+                else:
+                    stays = home > position or home <= following
+                if not stays:
+                    break
+            index[position] = slot
+            position = following
+
+    def __contains__(self, key):
+        slot = self._find(key)[1]
+        return slot != -1 and time.time() - self._times[slot] < self.ttl
+
+    def _evict(self, now, room=0):
+        """Drop the oldest entries while over the cap (leaving `room` free) or past the TTL"""
+        keys, times = self._keys, self._times
+        while self._count and (self._count + room > self.max_entries or now - times[self._head] >= self.ttl):
+            self._unindex(self._find(keys[self._head])[0])
+            self._head = (self._head + 1) % self.max_entries
+            self._count -= 1
+            self.evicted += 1
+
+    def _append(self, key, seen_at):
+        position, slot = self._find(key)
+        if slot != -1:
+            return False
+        slot = (self._head + self._count) % self.max_entries
+        self._keys[slot] = key
+        self._times[slot] = seen_at
+        self._index[position] = slot
+        self._count += 1
+        return True
+
+    def add(self, key):
+        """Record a listing; returns False if it was already seen"""
+        if key in self:
+            self.hits += 1
+            return False
+        now = time.time()
+        # Expired entries are the oldest, so this also forgets an expired copy of the key
+        self._evict(now, room=1)
+        if not self._append(key, now):
+            # Only with the clock set back: an expired copy newer than the oldest entry
+            self.hits += 1
+            return False
+        self._dirty = True
+        return True
+
+    def entries(self):
+        """(keys, times) arrays of the kept entries, oldest first"""
+        end = self._head + self._count
+        if end <= self.max_entries:
+            return self._keys[self._head:end], self._times[self._head:end]
+        end -= self.max_entries
+        return self._keys[self._head:] + self._keys[:end], self._times[self._head:] + self._times[:end]
+
+    def load(self):
+        """Reload the snapshot written by save(); returns the number of entries kept"""
+        try:
+            with open(self.path, "rb") as f:
+                header = f.read(16)
+                if len(header) != 16 or header[:8] != SNAPSHOT_MAGIC:
+                    return 0
+                (count,) = struct.unpack("<Q", header[8:])
+                keys = array("Q")
+                times = array("d")
+                keys.fromfile(f, count)
+                times.fromfile(f, count)
+        except (OSError, EOFError, struct.error):
+            return 0
+        self._clear()
+        for key, seen_at in sorted(zip(keys, times), key=lambda item: item[1])[-self.max_entries:]:
+            self._append(key, seen_at)
+        self._evict(time.time())
+        return self._count
+
+    def save(self):
+        """Write the snapshot atomically (temp file + rename)"""
+        keys, times = self.entries()
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(SNAPSHOT_MAGIC + struct.pack("<Q", len(keys)))
+            keys.tofile(f)
+            times.tofile(f)
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+        self._last_save = time.monotonic()
+
+    def maybe_save(self):
+        """Save if something changed and the last save is older than save_interval"""
+        if self._dirty and time.monotonic() - self._last_save >= self.save_interval:
+            self.save()
+
+    def stats(self):
+        return {"entries": self._count, "hits": self.hits, "evicted": self.evicted}
@@ -0,0 +1,194 @@
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from config import env_int
+
+
+def opensea_url(path):
+    """URL of an OpenSea API path; OPENSEA_API_BASE points the bot at another server (see replay.py)"""
+    return os.getenv("OPENSEA_API_BASE", "https://api.opensea.io").rstrip("/") + path
+
+
+def telegram_url(path):
+    """URL of a Telegram Bot API path; TELEGRAM_API_BASE overrides the server"""
+    return os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org").rstrip("/") + path
+
+
+def _settings():
+    return {
+        "pool_size": env_int("HTTP_POOL_SIZE", 100),
+        "per_host": env_int("HTTP_HOST_CONNECTIONS", 20),
+        "dns_ttl": env_int("HTTP_DNS_TTL", 300),
+        "keepalive": env_int("HTTP_KEEPALIVE", 60),
+        "compression": os.getenv("HTTP_COMPRESSION", "1").strip().lower() not in ("0", "false", "no", "off"),
+    }
+
+
+class HttpStats:
+    """Per-host request counts, latency and new connections of both clients
+
+    A new connection is a TCP (and TLS) handshake; with keep-alive working
+    it stays far below the request count.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hosts = {}
+
+    def _host(self, host):
+        entry = self.hosts.get(host)
+        if entry is None:
+            entry = self.hosts[host] = {
+                "requests": 0, "failed": 0, "connections": 0, "reused": 0,
+                "dns_lookups": 0, "total_ms": 0.0, "max_ms": 0.0,
+            }
+        return entry
+
+    def record_request(self, host, seconds, failed=False):
+        milliseconds = seconds * 1000
+        with self._lock:
+            entry = self._host(host)
+            entry["requests"] += 1
+            entry["failed"] += failed
+            entry["total_ms"] += milliseconds
+            entry["max_ms"] = max(entry["max_ms"], milliseconds)
+
+    def record(self, host, field, count=1):
+        with self._lock:
+            self._host(host)[field] += count
+
+    def snapshot(self, extra_connections=None):
+        """{host: stats} with the average latency, plus connections counted elsewhere"""
+        with self._lock:
+            hosts = {host: dict(entry) for host, entry in self.hosts.items()}
+        for host, count in (extra_connections or {}).items():
+            hosts.setdefault(host, {"requests": 0, "connections": 0})["connections"] += count
+        for entry in hosts.values():
+            if entry.get("requests"):
+                entry["avg_ms"] = round(entry["total_ms"] / entry["requests"], 1)
+            entry.pop("total_ms", None)
+            if "max_ms" in entry:
+                entry["max_ms"] = round(entry["max_ms"], 1)
+        return hosts
+
+
+HTTP_STATS = HttpStats()
+
+
+class InstrumentedSession(requests.Session):
+    """requests.Session timing every request into HTTP_STATS"""
+
+    def request(self, method, url, *args, **kwargs):
+        host = urlsplit(url).hostname
+        started = time.perf_counter()
+        try:
+            response = super().request(method, url, *args, **kwargs)
+        except requests.exceptions.RequestException:
+            HTTP_STATS.record_request(host, time.perf_counter() - started, failed=True)
+            raise
+        HTTP_STATS.record_request(host, time.perf_counter() - started, failed=response.status_code >= 400)
+        return response
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def http_session():
+    """The process-wide requests session for blocking calls
+
+    Keeps connections to each host alive between calls, so only the first
+    request to api.opensea.io or api.telegram.org pays for the handshake.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            settings = _settings()
+            session = InstrumentedSession()
+            adapter = HTTPAdapter(pool_connections=10, pool_maxsize=settings["per_host"])
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            if not settings["compression"]:
+                session.headers["Accept-Encoding"] = "identity"
+            _session = session
+        return _session
+
+
+def _sync_connections():
+    """New connections opened by the requests session, per host"""
+    counts = {}
+    if _session is None:
+        return counts
+    for adapter in set(_session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None:
+                counts[pool.host] = counts.get(pool.host, 0) + pool.num_connections
+    return counts
+
+
+def http_stats():
+    """Request, latency and handshake counts per host, for both clients"""
+    return HTTP_STATS.snapshot(_sync_connections())
+
+
+def trace_config(stats=HTTP_STATS):
+    """aiohttp tracing that records into `stats`"""
+    config = aiohttp.TraceConfig()
+
+    async def on_request_start(session, context, params):
+        context.host = params.url.host
+        context.started = time.perf_counter()
+
+    async def on_request_end(session, context, params):
+        stats.record_request(context.host, time.perf_counter() - context.started, failed=params.response.status >= 400)
+
+    async def on_request_exception(session, context, params):
+        stats.record_request(context.host, time.perf_counter() - context.started, failed=True)
+
+    async def on_connection_create_end(session, context, params):
+        stats.record(context.host, "connections")
+
+    async def on_connection_reuseconn(session, context, params):
+        stats.record(context.host, "reused")
+
+    async def on_dns_resolvehost_end(session, context, params):
+        stats.record(params.host, "dns_lookups")
+
+    config.on_request_start.append(on_request_start)
+    config.on_request_end.append(on_request_end)
+    config.on_request_exception.append(on_request_exception)
+    config.on_connection_create_end.append(on_connection_create_end)
+    config.on_connection_reuseconn.append(on_connection_reuseconn)
+    config.on_dns_resolvehost_end.append(on_dns_resolvehost_end)
+    return config
+
+
+def create_session(timeout=None, limit=None, limit_per_host=None):
+    """Pooled aiohttp session for the bot
+
+    One session should serve every host the bot talks to: connections are
+    kept alive for HTTP_KEEPALIVE seconds, DNS answers cached for
+    HTTP_DNS_TTL seconds and each host gets at most HTTP_HOST_CONNECTIONS
+    connections, so a burst of metadata requests cannot starve Telegram.
+    Must be called with an event loop running.
+    """
+    settings = _settings()
+    connector = aiohttp.TCPConnector(
+        limit=limit or settings["pool_size"],
+        limit_per_host=limit_per_host or settings["per_host"],
+        ttl_dns_cache=settings["dns_ttl"],
+        keepalive_timeout=settings["keepalive"],
+    )
+    headers = None if settings["compression"] else {"Accept-Encoding": "identity"}
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=timeout or aiohttp.ClientTimeout(total=15),
+        headers=headers,
+        trace_configs=[trace_config()],
+    )
@@ -0,0 +1,223 @@
+from datetime import datetime
+from utils import parse_retry_after
+from http_client import opensea_url
+from replay import RECORDER
+
+OPENSEA_EVENTS = "/api/v2/events"
+
+
+class ApiError(Exception):
+    """Non-200 response from the OpenSea API"""
+
+    def __init__(self, status, text="", retry_after=None):
+        super().__init__(f"{status} - {text}")
+        self.status = status
+        self.text = text
+        self.retry_after = retry_after
+
+
+def event_timestamp(event):
+    """Return the event time as unix seconds (0 if unknown)"""
+    value = event.get("event_timestamp") or event.get("created_date")
+    if value is None:
+        return 0
+    if isinstance(value, (int, float)):
+        return int(value)
+    try:
+        return int(value)
+    except ValueError:
+        pass
+    try:
+        return int(datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp())
+    except ValueError:
+        return 0
+
+
+def event_key(event):
+    """Identify an event for de-duplication at the cursor boundary"""
+    order_hash = event.get("order_hash")
+    if order_hash:
+        return order_hash
+    asset = event.get("asset") or {}
+    return (
+        asset.get("identifier") or asset.get("token_id"),
+        (event.get("payment") or {}).get("quantity") or event.get("starting_price"),
+        event_timestamp(event),
+    )
+
+
+class EventIngestor:
+    """Incremental poller for OpenSea listing events of one collection
+
+    Remembers the newest event timestamp it has handed out and, on every
+    poll, asks only for events after it, following the `next` cursor until
+    it has caught up. Pages beyond the first one are counted as a gap: those
+    are listings a single fixed-size poll would have missed.
+
+    A poll fetches at most `max_pages` pages. When the newest pages already
+    use them up, the older part of the catch-up is kept as a backlog (its
+    `after` and `next` cursor) and paged through by the following polls, so
+    a burst delays listings instead of skipping them.
+    """
+
+    def __init__(self, collection_slug, page_size=25, max_pages=20, url=None, scheduler=None):
+        self.collection_slug = collection_slug
+        self.scheduler = scheduler
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.url = url or opensea_url(OPENSEA_EVENTS)
+        self.last_timestamp = None
+        self._boundary_keys = set()
+        # Unfinished catch-ups, oldest first: {"after", "keys", "cursor"}
+        self.backlog = []
+        # Stats
+        self.polls = 0
+        self.pages = 0
+        self.last_pages = 0
+        self.last_truncated = False
+        self.gap_polls = 0
+        self.gap_pages = 0
+        self.gap_events = 0
+        self.truncated_polls = 0
+        self.backlog_events = 0
+        self.events = 0
+
+    def base_params(self, after=None):
+        params = {
+            "event_type": "item_listed",
+            "collection_slug": self.collection_slug,
+            "limit": self.page_size
+        }
+        if after is None:
+            after = self.last_timestamp
+        if after is not None:
+            params["after"] = after
+        return params
+
+    def is_new(self, event, after=None, keys=None):
+        """Whether an event is past the cursor and not one already handed out at its boundary
+
+        `after` and `keys` default to the live cursor; a backlog passes its own.
+        """
+        if after is None:
+            after, keys = self.last_timestamp, self._boundary_keys
+        if after is None:
+            return True
+        ts = event_timestamp(event)
+        if ts != after:
+            return ts > after
+        return event_key(event) not in keys
+
+    async def fetch_page(self, session, headers, cursor=None, after=None):
+        params = self.base_params(after)
+        if cursor:
+            params["next"] = cursor
+        if self.scheduler:
+            await self.scheduler.acquire()
+        async with session.get(self.url, params=params, headers=headers) as resp:
+            if resp.status != 200:
+                raise ApiError(resp.status, await resp.text(), parse_retry_after(resp.headers.get("Retry-After")))
+            data = await resp.json(content_type=None)
+        if RECORDER.enabled:
+            RECORDER.record("events", {"collection": self.collection_slug, "page": data})
+        return data
+
+    async def page_through(self, session, headers, after, keys, limit, cursor=None):
+        """Fetch up to `limit` pages of events past `after`, newest first
+
+        Returns (pages, cursor); the cursor is None once the catch-up reached
+        `after`, else where the next page starts.
+        """
+        pages = []
+        while len(pages) < limit:
+            data = await self.fetch_page(session, headers, cursor, after)
+            page = data.get("asset_events", [])
+            pages.append(page)
+            cursor = data.get("next")
+            # The first poll only establishes a baseline, like a single fixed poll did
+            if after is None or not cursor or len(page) < self.page_size:
+                return pages, None
+            # `after` is inclusive: a page reaching past the cursor, or holding
+            # nothing new (only listings at the boundary), ends the catch-up
+            if page and min(event_timestamp(e) for e in page) < after:
+                return pages, None
+            if not any(self.is_new(e, after, keys) for e in page):
+                return pages, None
+        return pages, cursor
+
+    async def poll(self, session, headers):
+        """Fetch every event newer than the cursor, oldest first
+
+        The newest pages come first, then what the page budget leaves goes to
+        the backlog. Raises ApiError on a non-200 page; nothing is advanced
+        until all pages of a poll were fetched, so a failed poll is retried in
+        full on the next one.
+        """
+        after, keys = self.last_timestamp, self._boundary_keys
+        pages, cursor = await self.page_through(session, headers, after, keys, self.max_pages)
+        truncated = cursor is not None
+        events = []
+        first_page_events = 0
+        for number, page in enumerate(pages):
+            events.extend(event for event in page if self.is_new(event))
+            if number == 0:
+                first_page_events = len(events)
+
+        backlog = [dict(entry) for entry in self.backlog]
+        if truncated:
+            backlog.append({"after": after, "keys": set(keys), "cursor": cursor})
+        budget = self.max_pages - len(pages)
+        recovered = 0
+        while backlog and budget > 0:
+            entry = backlog[0]
+            more, entry["cursor"] = await self.page_through(
+                session, headers, entry["after"], entry["keys"], budget, entry["cursor"]
+            )
+            budget -= len(more)
+            for page in more:
+                found = [event for event in page if self.is_new(event, entry["after"], entry["keys"])]
+                recovered += len(found)
+                events.extend(found)
+            pages.extend(more)
+            if entry["cursor"] is None:
+                backlog.pop(0)
+        events.sort(key=event_timestamp)
+
+        self.backlog = backlog
+        self.polls += 1
+        self.events += len(events)
+        self.pages += len(pages)
+        self.last_pages = len(pages)
+        self.last_truncated = truncated
+        self.backlog_events += recovered
+        # Only a gap if the extra pages held listings a single page would have missed
+        if len(pages) > 1 and len(events) > first_page_events:
+            self.gap_polls += 1
+            self.gap_pages += len(pages) - 1
+            self.gap_events += len(events) - first_page_events
+        if truncated:
+            self.truncated_polls += 1
+
+        if events:
+            # Backlog events are all older than the newest pages, which set the cursor
+            newest = event_timestamp(events[-1])
+            if self.last_timestamp is None or newest > self.last_timestamp:
+                self.last_timestamp = newest
+                self._boundary_keys = set()
+            self._boundary_keys.update(event_key(e) for e in events if event_timestamp(e) == self.last_timestamp)
+        return events
+
+    def stats(self):
+        return {
+            "polls": self.polls,
+            "pages": self.pages,
+            "last_pages": self.last_pages,
+            "gap_polls": self.gap_polls,
+            "gap_pages": self.gap_pages,
+            "events": self.events,
+            "gap_events": self.gap_events,
+            "truncated_polls": self.truncated_polls,
+            "backlog": len(self.backlog),
+            "backlog_events": self.backlog_events,
+            "last_timestamp": self.last_timestamp,
+        }
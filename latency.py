@@ -0,0 +1,113 @@
+import math
+import threading
+
+# Steps of a listing, each timed from the one before it
+STAGES = ("received", "dedup", "metadata", "score", "alert")
+# Listing time to decision (scored) and to alert sent
+TOTALS = ("decision", "total")
+
+_MIN_MS = 0.1
+_GROWTH = 1.08
+_BUCKETS = 240  # up to ~1.2 hours
+
+
+class LatencyHistogram:
+    """Latencies in log-spaced buckets
+
+    Constant memory and O(1) per sample; quantiles are bucket bounds, so
+    they are within 8% of the exact value.
+    """
+
+    def __init__(self):
+        self.counts = [0] * (_BUCKETS + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, milliseconds):
+        milliseconds = max(milliseconds, 0.0)
+        if milliseconds <= _MIN_MS:
+            bucket = 0
+        else:
+            bucket = min(math.ceil(math.log(milliseconds / _MIN_MS, _GROWTH)), _BUCKETS)
+        self.counts[bucket] += 1
+        self.count += 1
+        self.total += milliseconds
+        self.max = max(self.max, milliseconds)
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(_MIN_MS * _GROWTH ** bucket, self.max)
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "p50_ms": round(self.quantile(0.5), 1),
+            "p95_ms": round(self.quantile(0.95), 1),
+            "p99_ms": round(self.quantile(0.99), 1),
+            "max_ms": round(self.max, 1),
+            "avg_ms": round(self.total / self.count, 1),
+        }
+
+
+class LatencyStats:
+    """Histograms per collection and stage, safe to read from other threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+
+    def record(self, collection, stage, seconds):
+        with self._lock:
+            histogram = self.histograms.get((collection, stage))
+            if histogram is None:
+                histogram = self.histograms[(collection, stage)] = LatencyHistogram()
+            histogram.record(seconds * 1000)
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+
+    def snapshot(self):
+        """{collection: {stage: {count, p50_ms, p95_ms, p99_ms, max_ms, avg_ms}}}, stages in pipeline order"""
+        order = {stage: number for number, stage in enumerate(STAGES + TOTALS)}
+        with self._lock:
+            items = sorted(self.histograms.items(), key=lambda item: (item[0][0], order.get(item[0][1], len(order))))
+            result = {}
+            for (collection, stage), histogram in items:
+                result.setdefault(collection, {})[stage] = histogram.summary()
+        return result
+
+
+LATENCY = LatencyStats()
+
+
+def latency_stats():
+    """Current latency percentiles of the running bot (see LatencyStats.snapshot)"""
+    return LATENCY.snapshot()
+
+
+def _duration(milliseconds):
+    if milliseconds >= 1000:
+        return f"{milliseconds / 1000:.1f}s"
+    return f"{milliseconds:.0f}ms"
+
+
+def format_latency(snapshot):
+    """One text line per collection and stage"""
+    lines = []
+    for collection, stages in snapshot.items():
+        for stage, summary in stages.items():
+            lines.append(
+                f"{collection:<16} {stage:<9} n={summary['count']:<6} "
+                f"p50 {_duration(summary['p50_ms']):>7}  p95 {_duration(summary['p95_ms']):>7}  "
+                f"p99 {_duration(summary['p99_ms']):>7}"
+            )
+    return lines
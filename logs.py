@@ -0,0 +1,170 @@
+import json
+import logging
+import os
+import queue
+import threading
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from config import env_int
+
+LOGGER_NAME = "nft_sniper"
+LOG_FILE = "bot_log.jsonl"
+
+# Attributes every LogRecord has; anything else was passed as `extra`
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+
+def console(message):
+    """Print timestamped log message"""
+    timestamp = datetime.now().strftime("%H:%M:%S")
+    print(f"[{timestamp}] {message}")
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and any `extra` fields"""
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class SinkFormatter(logging.Formatter):
+    """The message as log_message callbacks always got it, debug lines marked"""
+
+    def format(self, record):
+        message = record.getMessage()
+        return f"[DEBUG] {message}" if record.levelno == logging.DEBUG else message
+
+
+class CallbackHandler(logging.Handler):
+    """Hands each formatted record to a log_message style callback"""
+
+    def __init__(self, callback):
+        super().__init__()
+        self.callback = callback
+        self.setFormatter(SinkFormatter())
+
+    def emit(self, record):
+        try:
+            self.callback(self.format(record))
+        except Exception:
+            self.handleError(record)
+
+
+class BotLog:
+    """Leveled front end of a logger that is also a log_message callback
+
+    log(message) keeps working everywhere a plain callback did: "❌" and
+    "💥" messages are logged as errors, "⚠️" as warnings and "[DEBUG]" as
+    debug, the rest as info. New code calls log.debug("... %s", value)
+    instead, so a disabled level costs one cached level check and the
+    message is never formatted; guard expensive arguments with
+    log.debug_enabled.
+    """
+
+    def __init__(self, logger):
+        self.logger = logger
+        self.debug = logger.debug
+        self.info = logger.info
+        self.warning = logger.warning
+        self.error = logger.error
+
+    @property
+    def debug_enabled(self):
+        return self.logger.isEnabledFor(logging.DEBUG)
+
+    def __call__(self, message):
+        if "[DEBUG]" in message:
+            level = logging.DEBUG
+            message = message.replace("[DEBUG] ", "", 1)
+        elif "❌" in message or "💥" in message:
+            level = logging.ERROR
+        elif "⚠️" in message:
+            level = logging.WARNING
+        else:
+            level = logging.INFO
+        if self.logger.isEnabledFor(level):
+            # Already formatted: keep a stray "%" from being read as a placeholder
+            self.logger.log(level, "%s", message)
+
+
+def log_level():
+    level = logging.getLevelName(os.getenv("LOG_LEVEL", "INFO").strip().upper())
+    return level if isinstance(level, int) else logging.INFO
+
+
+def log_directly():
+    """Print the bot's logs on the calling thread, for while no listener runs
+    (before start_logging() and after stop_logging())"""
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(log_level())
+    logger.propagate = False
+    logger.handlers = [CallbackHandler(console)]
+
+
+_listener = None
+_lock = threading.Lock()
+log_directly()
+
+
+def start_logging(sink=None):
+    """Route the bot's logs through a queue to `sink` and the JSON log file
+
+    Records are only queued on the calling thread; a listener thread
+    formats them, calls `sink` (a log_message callback, console() by
+    default) and appends JSON lines to LOG_FILE, rotated at
+    LOG_FILE_MAX_BYTES. Returns the BotLog to log with. Calling it again
+    replaces the sink.
+    """
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.close()
+        logger = logging.getLogger(LOGGER_NAME)
+        logger.setLevel(log_level())
+        logger.propagate = False
+        records = queue.SimpleQueue()
+        logger.handlers = [QueueHandler(records)]
+        handlers = [CallbackHandler(sink or console)]
+        path = os.getenv("LOG_FILE", LOG_FILE).strip()
+        if path and path.lower() not in ("0", "off", "none"):
+            try:
+                file_handler = RotatingFileHandler(
+                    path, maxBytes=env_int("LOG_FILE_MAX_BYTES", 5 * 1024 * 1024),
+                    backupCount=env_int("LOG_FILE_BACKUPS", 3), encoding="utf-8", delay=True
+                )
+                file_handler.setFormatter(JsonFormatter())
+                handlers.append(file_handler)
+            except OSError:
+                pass
+        _listener = QueueListener(records, *handlers)
+        _listener.start()
+    return BotLog(logger)
+
+
+def stop_logging():
+    """Deliver what is still queued and close the log file; later lines are printed directly"""
+    global _listener
+    with _lock:
+        if _listener is None:
+            return
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+        log_directly()
+
+
+def get_log(name=None):
+    """BotLog of the bot logger or one of its children ("nft_sniper.<name>")"""
+    return BotLog(logging.getLogger(f"{LOGGER_NAME}.{name}" if name else LOGGER_NAME))
@@ -0,0 +1,142 @@
+import math
+import time
+from collections import deque
+from config import env_float, env_int
+
+# Lower percentile bound of each rarity bucket: top 1%, 1-5%, 5-10%, 10-25%, 25-50%, the rest
+BUCKET_EDGES = (99.0, 95.0, 90.0, 75.0, 50.0, 0.0)
+
+
+def rarity_bucket(percentile):
+    """Index into BUCKET_EDGES of a percentile (None if unknown)"""
+    if percentile is None:
+        return None
+    for bucket, edge in enumerate(BUCKET_EDGES):
+        if percentile >= edge:
+            return bucket
+    return len(BUCKET_EDGES) - 1
+
+
+def bucket_label(bucket):
+    upper = 100.0 if bucket == 0 else BUCKET_EDGES[bucket - 1]
+    lower = BUCKET_EDGES[bucket]
+    if bucket == 0:
+        return f"top {100 - lower:g}%"
+    return f"top {100 - upper:g}-{100 - lower:g}%"
+
+
+class PriceWindow:
+    """Typical price of the last `size` listings: geometric mean, O(1) per update
+
+    The mean of log prices keeps one listing at 100x floor from dragging
+    the bucket's price the way an arithmetic mean would.
+    """
+
+    def __init__(self, size):
+        self.logs = deque(maxlen=size)
+        self.total = 0.0
+
+    def add(self, price):
+        value = math.log(price)
+        if len(self.logs) == self.logs.maxlen:
+            self.total -= self.logs[0]
+        self.logs.append(value)
+        self.total += value
+
+    def __len__(self):
+        return len(self.logs)
+
+    def typical(self):
+        return math.exp(self.total / len(self.logs)) if self.logs else None
+
+
+class MarketState:
+    """Rolling market view of one collection, fed by its listing events
+
+    Keeps the floor as the lowest listing price of the last `window`
+    seconds (a monotonic deque, amortized O(1) per listing) and the typical
+    listing price of each rarity bucket. Until a listing has been seen the
+    floor reported by the collection stats is used.
+    """
+
+    def __init__(self, window=None, bucket_size=None, min_samples=None):
+        self.window = window or env_float("MARKET_WINDOW", 6 * 3600)
+        self.bucket_size = bucket_size or env_int("MARKET_BUCKET_SIZE", 50)
+        self.min_samples = min_samples or env_int("MARKET_MIN_SAMPLES", 5)
+        # (timestamp, price) with increasing prices; the head is the window's minimum
+        self._lows = deque()
+        self._last_time = 0.0
+        self.buckets = [PriceWindow(self.bucket_size) for _ in BUCKET_EDGES]
+        self.stats_floor = None
+        # Stats
+        self.observed = 0
+
+    def seed_floor(self, stats):
+        """Take the floor price from an OpenSea collection stats response"""
+        try:
+            floor = float(((stats or {}).get("total") or {}).get("floor_price") or 0)
+        except (TypeError, ValueError):
+            return
+        if floor > 0:
+            self.stats_floor = floor
+
+    def _expire(self, now):
+        lows = self._lows
+        while lows and lows[0][0] < now - self.window:
+            lows.popleft()
+
+    def observe(self, price, percentile=None, timestamp=None):
+        """Record a listing at `price` ETH; `percentile` places it in a rarity bucket"""
+        if not price or price <= 0:
+            return
+        # Catch-up pages may be slightly out of order; the window only moves forward
+        now = max(timestamp or time.time(), self._last_time)
+        self._last_time = now
+        lows = self._lows
+        while lows and lows[-1][1] >= price:
+            lows.pop()
+        lows.append((now, price))
+        self._expire(now)
+        bucket = rarity_bucket(percentile)
+        if bucket is not None:
+            self.buckets[bucket].add(price)
+        self.observed += 1
+
+    def floor(self):
+        self._expire(max(time.time(), self._last_time))
+        if self._lows:
+            return self._lows[0][1]
+        return self.stats_floor
+
+    def reference_price(self, percentile):
+        """What a token of this rarity typically lists for: its bucket's price, else the floor"""
+        bucket = rarity_bucket(percentile)
+        if bucket is not None and len(self.buckets[bucket]) >= self.min_samples:
+            return self.buckets[bucket].typical()
+        return self.floor()
+
+    def deal(self, price, percentile, price_weight=None):
+        """(deal score 0-100, reference price), or (None, reference) if it cannot be scored
+
+        The score blends the rarity percentile with a price score of 50 at
+        the reference price, 100 at half of it and 0 at twice of it.
+        """
+        reference = self.reference_price(percentile)
+        if percentile is None or not reference or not price or price <= 0:
+            return None, reference
+        if price_weight is None:
+            price_weight = env_float("DEAL_PRICE_WEIGHT", 0.5)
+        price_weight = min(max(price_weight, 0.0), 1.0)
+        value = min(max(50.0 + 50.0 * math.log2(reference / price), 0.0), 100.0)
+        return round((1 - price_weight) * percentile + price_weight * value, 1), reference
+
+    def stats(self):
+        floor = self.floor()
+        return {
+            "observed": self.observed,
+            "floor": round(floor, 4) if floor else None,
+            "buckets": {
+                bucket_label(bucket): round(prices.typical(), 4)
+                for bucket, prices in enumerate(self.buckets) if len(prices)
+            },
+        }
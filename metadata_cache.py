@@ -0,0 +1,123 @@
+import json
+import sqlite3
+import time
+from collections import OrderedDict
+from config import env_int
+
+METADATA_CACHE_FILE = "metadata_cache.db"
+
+
+class MetadataCache:
+    """Token traits keyed by (contract, token_id), in memory and on disk
+
+    Traits almost never change, so entries live for `ttl` seconds (30
+    days by default) unless invalidated. The most recently used
+    `max_entries` tokens stay in an in-memory LRU; everything else is read
+    back from a small SQLite file, so relisted tokens cost no request even
+    after a restart.
+    """
+
+    def __init__(self, path=METADATA_CACHE_FILE, max_entries=None, ttl=None):
+        self.path = path
+        self.max_entries = max_entries or env_int("METADATA_CACHE_SIZE", 10000)
+        self.ttl = ttl or env_int("METADATA_CACHE_TTL", 30 * 24 * 3600)
+        self._lru = OrderedDict()
+        self._db = None
+        # Stats
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def open(self):
+        """Open (creating if needed) the on-disk store; the cache works in memory without it"""
+        if self._db is None:
+            self._db = sqlite3.connect(self.path)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS metadata ("
+                "contract TEXT NOT NULL, token_id TEXT NOT NULL, "
+                "fetched_at REAL NOT NULL, data TEXT NOT NULL, "
+                "PRIMARY KEY (contract, token_id))"
+            )
+            self._db.execute("DELETE FROM metadata WHERE fetched_at < ?", (time.time() - self.ttl,))
+            self._db.commit()
+        return self
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    @staticmethod
+    def _key(contract_address, token_id):
+        return (contract_address.lower(), str(token_id))
+
+    def _remember(self, key, fetched_at, metadata):
+        lru = self._lru
+        lru[key] = (fetched_at, metadata)
+        lru.move_to_end(key)
+        while len(lru) > self.max_entries:
+            lru.popitem(last=False)
+
+    def get(self, contract_address, token_id):
+        """Cached metadata of a token, or None if unknown or expired"""
+        key = self._key(contract_address, token_id)
+        now = time.time()
+        entry = self._lru.get(key)
+        if entry is not None:
+            if now - entry[0] < self.ttl:
+                self._lru.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self._lru[key]
+        elif self._db is not None:
+            row = self._db.execute(
+                "SELECT fetched_at, data FROM metadata WHERE contract = ? AND token_id = ?", key
+            ).fetchone()
+            if row is not None and now - row[0] < self.ttl:
+                metadata = json.loads(row[1])
+                self._remember(key, row[0], metadata)
+                self.hits += 1
+                self.disk_hits += 1
+                return metadata
+        self.misses += 1
+        return None
+
+    def put(self, contract_address, token_id, metadata):
+        key = self._key(contract_address, token_id)
+        fetched_at = time.time()
+        self._remember(key, fetched_at, metadata)
+        if self._db is not None:
+            self._db.execute(
+                "INSERT OR REPLACE INTO metadata (contract, token_id, fetched_at, data) VALUES (?, ?, ?, ?)",
+                key + (fetched_at, json.dumps(metadata, separators=(",", ":")))
+            )
+            self._db.commit()
+
+    def invalidate(self, contract_address, token_id=None):
+        """Forget one token, or a whole contract when token_id is None"""
+        contract = contract_address.lower()
+        if token_id is None:
+            for key in [key for key in self._lru if key[0] == contract]:
+                del self._lru[key]
+            if self._db is not None:
+                self._db.execute("DELETE FROM metadata WHERE contract = ?", (contract,))
+        else:
+            key = self._key(contract_address, token_id)
+            self._lru.pop(key, None)
+            if self._db is not None:
+                self._db.execute("DELETE FROM metadata WHERE contract = ? AND token_id = ?", key)
+        if self._db is not None:
+            self._db.commit()
+
+    def hit_ratio(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {
+            "entries": len(self._lru),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hit_ratio(), 3),
+        }
@@ -0,0 +1,73 @@
+import time
+from aiohttp import web
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _number(value):
+    if value is None:
+        return "NaN"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(families):
+    """Prometheus text exposition of [(name, kind, help, samples), ...]
+
+    A sample is (labels, value), or (suffix, labels, value) for the
+    _count and _sum series of a summary.
+    """
+    lines = []
+    for name, kind, help_text, samples in families:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for sample in samples:
+            suffix, labels, value = sample if len(sample) == 3 else ("", *sample)
+            if labels:
+                suffix += "{" + ",".join(f'{key}="{_escape(label)}"' for key, label in labels.items()) + "}"
+            lines.append(f"{name}{suffix} {_number(value)}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """/metrics endpoint on the bot's own event loop
+
+    `collect` returns the metric families (see render()) and is only
+    called when the endpoint is scraped, so the bot pays nothing between
+    scrapes. Binds to localhost unless `host` says otherwise.
+    """
+
+    def __init__(self, collect, port, host="127.0.0.1"):
+        self.collect = collect
+        self.port = port
+        self.host = host
+        self.runner = None
+        self.started_at = time.time()
+        # Stats
+        self.scrapes = 0
+
+    async def handle(self, request):
+        self.scrapes += 1
+        families = self.collect()
+        families.append(("nft_sniper_start_time_seconds", "gauge", "Unix time the bot started",
+                         [({}, round(self.started_at, 3))]))
+        families.append(("nft_sniper_metrics_scrapes_total", "counter", "Scrapes of this endpoint",
+                         [({}, self.scrapes)]))
+        return web.Response(body=render(families).encode("utf-8"), headers={"Content-Type": CONTENT_TYPE})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+
+    async def close(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
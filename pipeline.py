@@ -0,0 +1,164 @@
+import asyncio
+import traceback
+
+
+class Listing:
+    """One listing on its way through a collection's pipeline
+
+    The normalizer fills in what the event says; later stages add the
+    metadata, score and market figures.
+    """
+
+    def __init__(self, token_id, name, price_wei, permalink, order_hash=None, listed_at=0, asset=None,
+                 received_at=None):
+        self.token_id = token_id
+        self.name = name
+        self.price_wei = price_wei
+        self.price_eth = price_wei / (10 ** 18)
+        self.permalink = permalink
+        self.order_hash = order_hash
+        self.listed_at = listed_at
+        self.asset = asset or {}
+        # Wall-clock times: when the poll returned it, and when it finished its latest step
+        self.received_at = received_at
+        self.stamped_at = received_at
+        self.metadata = None
+        self.source = None
+        self.score = None
+        self.rank = None
+        self.percentile = None
+        self.deal = None
+        self.reference = None
+
+
+class Stage:
+    """A step of a Pipeline: `workers` tasks draining one bounded queue
+
+    `handler` is an async callable taking an item; what it returns is
+    passed to the next stage, None drops the item. put() waits while the
+    queue holds `maxsize` items, which is what pushes back on the stages
+    feeding it. `on_idle` is called whenever the queue runs empty, to
+    batch up work such as saving state.
+    """
+
+    def __init__(self, name, handler, workers=1, maxsize=100, on_idle=None):
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.queue = asyncio.Queue(maxsize)
+        self.on_idle = on_idle
+        self.output = None
+        self.tasks = []
+        self.busy = 0
+        # Stats
+        self.processed = 0
+        self.dropped = 0
+        self.errors = 0
+        self.max_depth = 0
+        self.blocked = 0
+
+    async def put(self, item):
+        if self.queue.full():
+            self.blocked += 1
+        await self.queue.put(item)
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+
+    def start(self, log_message):
+        for _ in range(self.workers - len(self.tasks)):
+            self.tasks.append(asyncio.create_task(self._work(log_message)))
+
+    async def _work(self, log_message):
+        while True:
+            item = await self.queue.get()
+            self.busy += 1
+            try:
+                result = await self.handler(item)
+                self.processed += 1
+                if result is None:
+                    self.dropped += 1
+                elif self.output is not None:
+                    await self.output.put(result)
+            except Exception as e:
+                self.errors += 1
+                log_message(f"❌ Error in {self.name} stage: {e}\n{traceback.format_exc()}")
+            finally:
+                self.busy -= 1
+                self.queue.task_done()
+            if self.busy == 0 and self.queue.empty():
+                self.idle(log_message)
+
+    def idle(self, log_message):
+        if self.on_idle is None:
+            return
+        try:
+            self.on_idle()
+        except Exception as e:
+            log_message(f"❌ Error in {self.name} stage: {e}\n{traceback.format_exc()}")
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def stats(self):
+        return {
+            "depth": self.queue.qsize(),
+            "max_depth": self.max_depth,
+            "in_flight": self.busy,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "blocked": self.blocked,
+        }
+
+
+class Pipeline:
+    """Stages connected by bounded queues, fed through feed()
+
+    Each stage runs its own workers, so a slow stage only holds up the
+    stages before it once its queue is full, instead of the whole poll.
+    """
+
+    def __init__(self, stages, log_message):
+        self.stages = stages
+        self.log_message = log_message
+        for stage, following in zip(stages, stages[1:]):
+            stage.output = following
+
+    def start(self):
+        for stage in self.stages:
+            stage.start(self.log_message)
+
+    async def feed(self, items):
+        """Hand items to the first stage, waiting while it is full"""
+        for item in items:
+            await self.stages[0].put(item)
+
+    async def join(self):
+        """Wait until everything fed so far has passed every stage"""
+        for stage in self.stages:
+            await stage.queue.join()
+
+    async def close(self, timeout=10.0):
+        """Finish what is still queued (up to `timeout` seconds), stop every worker,
+        then run the idle hooks so batched work is not lost
+
+        Queued listings are already marked seen, so dropping them would lose them for good.
+        """
+        if any(stage.tasks and (stage.busy or stage.queue.qsize()) for stage in self.stages):
+            try:
+                await asyncio.wait_for(self.join(), timeout)
+            except asyncio.TimeoutError:
+                left = sum(stage.queue.qsize() + stage.busy for stage in self.stages)
+                self.log_message(f"⚠️ Dropped {left} queued listings on shutdown")
+        for stage in self.stages:
+            await stage.stop()
+        for stage in self.stages:
+            stage.idle(self.log_message)
+
+    def depths(self):
+        return {stage.name: stage.queue.qsize() for stage in self.stages}
+
+    def stats(self):
+        return {stage.name: stage.stats() for stage in self.stages}
@@ -0,0 +1,484 @@
+import bisect
+import math
+import sys
+from array import array
+from collections import ChainMap
+import scoring
+
+# Token ids up to this many slots past the table size are stored in a flat
+# array; sparse or huge ids (e.g. ENS hashes) fall back to a dict.
+DENSE_TOKEN_SLACK = 1 << 16
+# Trait count updates touching at least this many tokens rescore the whole
+# table in one vectorized pass instead of token by token
+BATCH_RESCORE_MIN = 2048
+# Share of the supply the token table must hold to count as the whole collection
+TABLE_COVERAGE = 0.95
+# Tokens added since the ranks were computed are placed by score; the ranks
+# are rebuilt once more than this many (or this share of the table) piled up
+RANK_REBUILD_MIN = 64
+RANK_REBUILD_SHARE = 0.01
+
+
+def token_key(token_id):
+    """Normalize a token id to an int when possible"""
+    try:
+        return int(token_id)
+    except (TypeError, ValueError):
+        return token_id
+
+
+def estimate_total_supply(counts):
+    """Best guess of the supply from trait counts: the most populated trait type"""
+    totals = [sum(values.values()) for values in counts.values() if isinstance(values, dict)]
+    return max(totals) if totals else 0
+
+
+class RankTable:
+    """Ranks and percentiles of a collection's tokens, precomputed from their scores
+
+    Tokens are ranked rarest first with ties sharing a rank (1, 2, 2, 4).
+    A token's percentile is the share of the collection scoring at most as
+    much as it, so the rarest token is at 100 and "top 5%" is >= 95.
+    """
+
+    def __init__(self, scores):
+        keys = list(scores)
+        values = [scores[key] for key in keys]
+        self.size = len(keys)
+        if scoring.np is not None and keys:
+            np = scoring.np
+            array_values = np.asarray(values, dtype=np.float64)
+            order = np.argsort(-array_values, kind="stable")
+            ordered = array_values[order]
+            positions = np.arange(self.size)
+            starts = np.where(np.r_[True, ordered[1:] != ordered[:-1]], positions, 0)
+            ranks = (np.maximum.accumulate(starts) + 1).tolist()
+            order = order.tolist()
+            self.ascending = ordered[::-1].tolist()
+        else:
+            order = sorted(range(self.size), key=values.__getitem__, reverse=True)
+            ranks = []
+            previous = None
+            for position, i in enumerate(order):
+                if position == 0 or values[i] != previous:
+                    rank = position + 1
+                    previous = values[i]
+                ranks.append(rank)
+            self.ascending = sorted(values)
+        self.ordered_keys = [keys[i] for i in order]
+        self._ranks = dict(zip(self.ordered_keys, ranks))
+
+    def rank(self, key):
+        return self._ranks.get(key)
+
+    def token_at(self, rank):
+        """Token holding a rank (1 = rarest), None if out of range"""
+        if 1 <= rank <= self.size:
+            return self.ordered_keys[rank - 1]
+        return None
+
+    def rank_of_score(self, score):
+        """Rank a token with this score would have"""
+        return self.size - bisect.bisect_right(self.ascending, score) + 1
+
+    def percentile_of_rank(self, rank):
+        if not self.size:
+            return None
+        return 100.0 * min(self.size, self.size - rank + 1) / self.size
+
+    def percentile(self, score):
+        if not self.size:
+            return None
+        return 100.0 * bisect.bisect_right(self.ascending, score) / self.size
+
+
+class RarityIndex:
+    """Traits cache compiled for constant-time rarity scoring
+
+    Every (trait_type, value) pair is interned to a small integer id whose
+    inverse frequency (1 / occurrence) is precomputed. Scores of known
+    tokens live in a per-token table, so scoring a listing is a single
+    lookup; the per-trait formula is only used for tokens that are not in
+    the table yet, and its result is remembered.
+
+    Weights and table entries are kept relative to the total supply, so a
+    supply change is O(1) and a trait count change only rescores the
+    tokens that carry that trait.
+    """
+
+    def __init__(self, traits_cache, total_supply, token_traits=None):
+        self.total_supply = total_supply
+        self.trait_ids = {}
+        self.trait_names = []
+        self.trait_types = []
+        self.trait_type_ids = {}
+        self.trait_columns = array("I")
+        self.counts = array("q")
+        self.inverse = array("d")
+        self._dense_scores = array("d")
+        self._sparse_scores = {}
+        self._token_ids = {}
+        self._members = []
+        # Raw traits of tokens carrying values the index did not know yet, re-encoded once it does
+        self._unencoded = {}
+        self._matrix = None
+        self._ranks = None
+        self._unranked = 0
+        # None: the built-in average inverse model, kept in the tables above
+        self.engine = None
+        self._engine_scores = {}
+        for trait_type, values in (traits_cache or {}).items():
+            if not isinstance(values, dict):
+                continue
+            for value, occurrence in values.items():
+                self.add_trait(trait_type, value, occurrence)
+        if token_traits:
+            self.build_token_table(token_traits)
+
+    @classmethod
+    def from_cache(cls, entry, total_supply=None, engine=None):
+        """Build an index from a collection's traits cache entry
+
+        `total_supply` is used when the entry does not know its supply, and
+        the supply is estimated from the trait counts as a last resort.
+        `engine` is an optional ScoringEngine to score with.
+        """
+        counts = entry.get("traits") or {}
+        supply = entry.get("total_supply") or total_supply or estimate_total_supply(counts)
+        index = cls(counts, supply, entry.get("tokens"))
+        if engine is not None:
+            index.use_engine(engine)
+        return index
+
+    def __len__(self):
+        return len(self.trait_names)
+
+    def add_trait(self, trait_type, value, occurrence):
+        """Intern a trait pair, set its occurrence count and return its id"""
+        key = (sys.intern(str(trait_type)), sys.intern(str(value)))
+        trait_id = self.trait_ids.get(key)
+        if trait_id is None:
+            trait_id = len(self.trait_names)
+            self.trait_ids[key] = trait_id
+            self.trait_names.append(key)
+            column = self.trait_type_ids.get(key[0])
+            if column is None:
+                column = len(self.trait_types)
+                self.trait_type_ids[key[0]] = column
+                self.trait_types.append(key[0])
+            self.trait_columns.append(column)
+            self.counts.append(0)
+            self.inverse.append(0.0)
+            self._members.append([])
+        self.counts[trait_id] = int(occurrence)
+        self.inverse[trait_id] = 1 / occurrence if occurrence > 0 else 0.0
+        return trait_id
+
+    def trait_id(self, trait_type, value):
+        return self.trait_ids.get((trait_type, str(value)))
+
+    def weight(self, trait_id):
+        """Inverse-frequency weight (total_supply / occurrence) of a trait"""
+        return self.total_supply * self.inverse[trait_id]
+
+    def counts_dict(self):
+        """Trait counts in the {trait_type: {value: count}} cache layout"""
+        counts = {}
+        for (trait_type, value), count in zip(self.trait_names, self.counts):
+            counts.setdefault(trait_type, {})[value] = count
+        return counts
+
+    def encode(self, traits, unknown=None):
+        """Map traits to interned trait ids (unknown traits dropped, and appended to `unknown` if given)
+
+        Accepts an OpenSea traits list or a {trait_type: value} mapping.
+        """
+        if isinstance(traits, dict):
+            pairs = traits.items()
+        else:
+            pairs = ((trait.get("trait_type"), trait.get("value")) for trait in traits or [])
+        ids = []
+        for trait_type, value in pairs:
+            if trait_type and value:
+                trait_id = self.trait_ids.get((trait_type, str(value)))
+                if trait_id is not None:
+                    ids.append(trait_id)
+                elif unknown is not None:
+                    unknown.append((trait_type, value))
+        return ids
+
+    def _relative_score(self, trait_ids):
+        """Average inverse frequency of the traits, before scaling by supply"""
+        inverse = self.inverse
+        score = 0.0
+        trait_count = 0
+        for trait_id in trait_ids:
+            weight = inverse[trait_id]
+            if weight > 0:
+                score += weight
+                trait_count += 1
+        if trait_count > 0:
+            score = score / trait_count
+        return score
+
+    def score_ids(self, trait_ids):
+        """Average inverse frequency of the given traits, like calculate_rarity_score"""
+        return round(self._relative_score(trait_ids) * self.total_supply, 2)
+
+    def score_traits(self, traits):
+        if not traits:
+            return 0.0
+        return self.score_ids(self.encode(traits))
+
+    def _lookup_relative(self, key):
+        if isinstance(key, int) and 0 <= key < len(self._dense_scores):
+            score = self._dense_scores[key]
+            if not math.isnan(score):
+                return score
+        return self._sparse_scores.get(key)
+
+    def lookup(self, token_id):
+        """Precomputed score for a token, or None if it is not in the table"""
+        if self.engine is not None:
+            return self._engine_scores.get(token_key(token_id))
+        score = self._lookup_relative(token_key(token_id))
+        if score is None:
+            return None
+        return round(score * self.total_supply, 2)
+
+    def _store_relative(self, key, score):
+        dense = self._dense_scores
+        if isinstance(key, int) and 0 <= key < len(dense) + DENSE_TOKEN_SLACK:
+            if key >= len(dense):
+                dense.extend([math.nan] * (key + 1 - len(dense)))
+            dense[key] = score
+        else:
+            self._sparse_scores[key] = score
+
+    def add_token(self, token_id, traits):
+        """Encode a token's traits, store its score and return it"""
+        key = token_key(token_id)
+        unknown = []
+        trait_ids = self.encode(traits, unknown)
+        if unknown:
+            self._unencoded[key] = traits
+        else:
+            self._unencoded.pop(key, None)
+        self._set_trait_ids(key, array("I", trait_ids))
+        self._matrix = None
+        # Keep the ranks: standing() places the token by its score until the next rebuild
+        self._unranked += 1
+        score = self._relative_score(trait_ids)
+        self._store_relative(key, score)
+        if self.engine is not None:
+            score = self._engine_scores[key] = self.engine.score_ids(trait_ids)
+            return score
+        return round(score * self.total_supply, 2)
+
+    def _set_trait_ids(self, key, trait_ids):
+        previous = self._token_ids.get(key)
+        if previous is not None:
+            for trait_id in previous:
+                self._members[trait_id].remove(key)
+        self._token_ids[key] = trait_ids
+        for trait_id in trait_ids:
+            self._members[trait_id].append(key)
+
+    def reencode(self):
+        """Encode again the tokens whose traits were partly unknown; returns the keys that gained traits"""
+        gained = []
+        for key, traits in list(self._unencoded.items()):
+            unknown = []
+            trait_ids = self.encode(traits, unknown)
+            if not unknown:
+                del self._unencoded[key]
+            if len(trait_ids) > len(self._token_ids.get(key) or ()):
+                self._set_trait_ids(key, array("I", trait_ids))
+                gained.append(key)
+        if gained:
+            self._matrix = None
+        return gained
+
+    def build_token_table(self, token_traits):
+        """Precompute scores for every token in a {token_id: traits} mapping"""
+        if hasattr(token_traits, "encoded"):
+            self.build_encoded_table(token_traits.trait_pairs(), token_traits.encoded())
+            return
+        if isinstance(token_traits, ChainMap):
+            # Saved table plus journaled tokens: oldest layer first
+            for layer in reversed(token_traits.maps):
+                self.build_token_table(layer)
+            return
+        for token_id, traits in token_traits.items():
+            self.add_token(token_id, traits)
+
+    def build_encoded_table(self, trait_pairs, rows):
+        """Precompute scores from already encoded tokens (binary traits cache)
+
+        `rows` yields (token_id, trait indexes into `trait_pairs`). When the
+        file's trait order matches the index, the indexes are kept as-is
+        (views into the mapped file) instead of being copied.
+        """
+        self._matrix = None
+        self._ranks = None
+        mapping = [self.trait_ids.get(pair) for pair in trait_pairs]
+        identity = all(trait_id == index for index, trait_id in enumerate(mapping))
+        for token_id, indexes in rows:
+            key = token_key(token_id)
+            if identity:
+                trait_ids = indexes
+            else:
+                trait_ids = array("I", (mapping[i] for i in indexes if mapping[i] is not None))
+                if len(trait_ids) < len(indexes):
+                    self._unencoded[key] = [
+                        {"trait_type": trait_pairs[i][0], "value": trait_pairs[i][1]} for i in indexes
+                    ]
+            self._set_trait_ids(key, trait_ids)
+            self._store_relative(key, self._relative_score(trait_ids))
+
+    def score(self, token_id, traits=None):
+        """Rarity score of a token: table lookup, falling back to its traits"""
+        score = self.lookup(token_id)
+        if score is None:
+            if not traits:
+                return 0.0
+            score = self.add_token(token_id, traits)
+        return score
+
+    def set_total_supply(self, total_supply):
+        """Change the supply; every weight and table score follows in O(1)
+
+        (A plugged-in engine is re-prepared, a vectorized pass.)
+        """
+        if total_supply and total_supply > 0:
+            self.total_supply = total_supply
+            self._ranks = None
+            if self.engine is not None:
+                self.refresh_engine()
+
+    def count_changes(self, counts):
+        """The part of a {trait_type: {value: count}} mapping that differs from the index"""
+        changes = {}
+        for trait_type, values in counts.items():
+            if not isinstance(values, dict):
+                continue
+            for value, occurrence in values.items():
+                trait_id = self.trait_id(trait_type, value)
+                if trait_id is None or self.counts[trait_id] != int(occurrence):
+                    changes.setdefault(trait_type, {})[value] = int(occurrence)
+        return changes
+
+    def update_counts(self, counts):
+        """Apply new trait counts, rescoring only tokens with a changed trait
+
+        Returns the number of trait values whose count changed.
+        """
+        changed = set()
+        known = len(self.trait_names)
+        for trait_type, values in counts.items():
+            if not isinstance(values, dict):
+                continue
+            for value, occurrence in values.items():
+                trait_id = self.trait_id(trait_type, value)
+                if trait_id is not None and self.counts[trait_id] == int(occurrence):
+                    continue
+                changed.add(self.add_trait(trait_type, value, occurrence))
+        affected = set()
+        if len(self.trait_names) > known:
+            # Tokens listed before these values were counted get them now
+            affected.update(self.reencode())
+        for trait_id in changed:
+            affected.update(self._members[trait_id])
+        if len(affected) >= BATCH_RESCORE_MIN and scoring.np is not None:
+            self.rescore_all()
+        else:
+            for key in affected:
+                self._store_relative(key, self._relative_score(self._token_ids[key]))
+        if changed:
+            self._ranks = None
+            if self.engine is not None:
+                self.refresh_engine()
+        return len(changed)
+
+    def use_engine(self, engine):
+        """Score with a ScoringEngine (None: the built-in average inverse model)"""
+        if engine is not None and engine.name == scoring.DEFAULT_FORMULA:
+            engine = None
+        self.engine = engine
+        self.refresh_engine()
+
+    def refresh_engine(self):
+        """Re-prepare the engine and precompute its score for every tabled token"""
+        self._ranks = None
+        if self.engine is None:
+            self._engine_scores = {}
+            return
+        self.engine.prepare(self)
+        matrix = self.trait_matrix()
+        self._engine_scores = dict(zip(matrix.keys, self.engine.score_matrix(matrix)))
+
+    def rank_table(self):
+        """RankTable of the tabled tokens (rebuilt after the weights change or a batch of new tokens)"""
+        if self._ranks is None or self._unranked > max(RANK_REBUILD_MIN, self._ranks.size * RANK_REBUILD_SHARE):
+            self._ranks = RankTable(self.score_all())
+            self._unranked = 0
+        return self._ranks
+
+    def rank(self, token_id):
+        """Rank of a tabled token (1 = rarest), None if unknown"""
+        return self.rank_table().rank(token_key(token_id))
+
+    def percentile(self, score):
+        """Share (0-100) of the tabled tokens scoring at most `score`, None without a table"""
+        return self.rank_table().percentile(score)
+
+    def standing(self, token_id, score):
+        """(rank, percentile) of a token: a lookup for tabled tokens, else placed by score
+
+        Both are None until the table covers the collection: ranked against
+        only the tokens seen in listings, any listing would rank near the top.
+        """
+        if not self.covers_collection():
+            return None, None
+        table = self.rank_table()
+        rank = table.rank(token_key(token_id))
+        if rank is None or self.lookup(token_id) != score:
+            rank = table.rank_of_score(score)
+        return rank, table.percentile_of_rank(rank)
+
+    def token_keys(self):
+        return list(self._token_ids)
+
+    def token_trait_ids(self, token_id):
+        """Encoded traits of a token in the table (None if unknown)"""
+        return self._token_ids.get(token_key(token_id))
+
+    def trait_matrix(self):
+        """TraitMatrix of every token in the table (cached until the table changes)"""
+        if self._matrix is None or self._matrix.type_count != len(self.trait_types):
+            self._matrix = scoring.TraitMatrix.from_index(self)
+        return self._matrix
+
+    def rescore_all(self, formula=scoring.DEFAULT_FORMULA):
+        """Recompute every table score in one vectorized pass"""
+        matrix = self.trait_matrix()
+        scores = scoring.relative_scores(self, matrix, formula)
+        store = self._store_relative
+        for key, score in zip(matrix.keys, scores.tolist() if hasattr(scores, "tolist") else scores):
+            store(key, score)
+        return len(matrix.keys)
+
+    def score_all(self, formula=scoring.DEFAULT_FORMULA):
+        """{token: score} for the whole table, computed in one batch"""
+        if self.engine is not None and formula == scoring.DEFAULT_FORMULA:
+            return dict(self._engine_scores)
+        matrix = self.trait_matrix()
+        return dict(zip(matrix.keys, scoring.score_batch(self, matrix, formula)))
+
+    def token_count(self):
+        return len(self._token_ids)
+
+    def covers_collection(self):
+        """Whether the token table holds (nearly) every token of the collection,
+        rather than only the tokens seen in listings so far"""
+        return self.total_supply > 0 and self.token_count() >= self.total_supply * TABLE_COVERAGE
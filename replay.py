@@ -0,0 +1,354 @@
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+from bisect import bisect_left
+from aiohttp import web
+from config import env_float, env_int
+
+
+class Recorder:
+    """Appends the raw OpenSea responses the bot receives to a recording directory
+
+    Started from RECORD_DIR by run_bot; the events pages, asset metadata,
+    collection stats and traits responses go to <kind>.jsonl, which
+    Recording.load() and ReplayServer serve back offline.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.path = None
+        self.enabled = False
+        self._files = {}
+        # Stats
+        self.records = 0
+
+    def start(self, path):
+        with self._lock:
+            os.makedirs(path, exist_ok=True)
+            self.path = path
+            self.enabled = True
+
+    def record(self, kind, entry):
+        line = json.dumps({"t": round(time.time(), 3), **entry}, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            if not self.enabled:
+                return
+            f = self._files.get(kind)
+            if f is None:
+                f = self._files[kind] = open(os.path.join(self.path, f"{kind}.jsonl"), "a", encoding="utf-8")
+            f.write(line + "\n")
+            f.flush()
+            self.records += 1
+
+    def stop(self):
+        with self._lock:
+            self.enabled = False
+            for f in self._files.values():
+                f.close()
+            self._files = {}
+
+
+RECORDER = Recorder()
+
+
+def start_recording(path=None):
+    """Record to `path` (default: RECORD_DIR); returns the directory, or None when recording is off"""
+    path = path or os.getenv("RECORD_DIR", "").strip()
+    if not path:
+        return None
+    RECORDER.start(path)
+    return path
+
+
+def _read_lines(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    except FileNotFoundError:
+        return
+
+
+class Recording:
+    """Responses of a recording directory, ready to be served
+
+    Events are de-duplicated across the overlapping pages of consecutive
+    polls and kept oldest first per collection.
+    """
+
+    def __init__(self, events=None, metadata=None, stats=None, traits=None):
+        self.events = events or {}
+        self.metadata = metadata or {}
+        self.stats = stats or {}
+        self.traits = traits or {}
+
+    @classmethod
+    def load(cls, path):
+        from ingest import event_key, event_timestamp
+
+        events = {}
+        for entry in _read_lines(os.path.join(path, "events.jsonl")):
+            unique = events.setdefault(entry["collection"], {})
+            for event in (entry.get("page") or {}).get("asset_events", []):
+                unique.setdefault(event_key(event), event)
+        events = {
+            collection: sorted(unique.values(), key=event_timestamp) for collection, unique in events.items()
+        }
+        metadata = {
+            (entry["contract"].lower(), str(entry["token_id"])): entry["data"]
+            for entry in _read_lines(os.path.join(path, "metadata.jsonl"))
+        }
+        stats = {entry["collection"]: entry["data"] for entry in _read_lines(os.path.join(path, "stats.jsonl"))}
+        traits = {entry["collection"]: entry["data"] for entry in _read_lines(os.path.join(path, "traits.jsonl"))}
+        return cls(events, metadata, stats, traits)
+
+    def listings(self):
+        return sum(len(events) for events in self.events.values())
+
+
+def synthesize(path, collection="bench-collection", contract="0x" + "be" * 20, tokens=10000, listings=100000,
+               per_second=50, floor=0.5, seed=1):
+    """Write a synthetic recording: a collection of `tokens` NFTs and `listings` listing events
+
+    Traits follow a skewed distribution and prices scatter around `floor`
+    with a premium for rare tokens, so scores and deal scores spread out
+    like a real collection's. Events are `per_second` apart, in pages of
+    50 as polls would have recorded them.
+    """
+    rng = random.Random(seed)
+    os.makedirs(path, exist_ok=True)
+    trait_types = [(f"Trait {number}", [f"Value {value}" for value in range(4 + 3 * number)]) for number in range(7)]
+    counts = {trait_type: {} for trait_type, _ in trait_types}
+    token_traits = []
+    rarity = []
+    with open(os.path.join(path, "metadata.jsonl"), "w", encoding="utf-8") as f:
+        for token_id in range(tokens):
+            traits = []
+            for trait_type, values in trait_types:
+                value = values[min(int(rng.paretovariate(1.2)) - 1, len(values) - 1)]
+                counts[trait_type][value] = counts[trait_type].get(value, 0) + 1
+                traits.append({"trait_type": trait_type, "value": value})
+            token_traits.append(traits)
+            data = {"nft": {"identifier": str(token_id), "contract": contract, "traits": traits}}
+            f.write(json.dumps({"contract": contract, "token_id": str(token_id), "data": data}) + "\n")
+    for traits in token_traits:
+        rarity.append(sum(math.log(tokens / counts[trait["trait_type"]][trait["value"]]) for trait in traits))
+    order = sorted(range(tokens), key=rarity.__getitem__)
+    percentile = [0.0] * tokens
+    for position, token_id in enumerate(order):
+        percentile[token_id] = position / tokens
+    with open(os.path.join(path, "stats.jsonl"), "w", encoding="utf-8") as f:
+        f.write(json.dumps({"collection": collection, "data": {
+            "total": {"floor_price": floor}, "stats": {"total_supply": tokens}
+        }}) + "\n")
+    with open(os.path.join(path, "traits.jsonl"), "w", encoding="utf-8") as f:
+        f.write(json.dumps({"collection": collection, "data": {"counts": counts}}) + "\n")
+    started = int(time.time()) - listings // per_second - 1
+    with open(os.path.join(path, "events.jsonl"), "w", encoding="utf-8") as f:
+        page = []
+        for number in range(listings):
+            token_id = rng.randrange(tokens)
+            price = floor * math.exp(rng.gauss(0, 0.35)) * (1 + 3 * percentile[token_id] ** 8)
+            page.append({
+                "event_type": "order",
+                "order_type": "listing",
+                "order_hash": f"0x{number:064x}",
+                "event_timestamp": started + number // per_second,
+                "asset": {
+                    "identifier": str(token_id),
+                    "name": f"Bench #{token_id}",
+                    "opensea_url": f"https://opensea.io/assets/ethereum/{contract}/{token_id}",
+                },
+                "payment": {"quantity": str(int(price * 10 ** 18)), "decimals": 18, "symbol": "ETH"},
+            })
+            if len(page) == 50 or number == listings - 1:
+                # Pages are recorded newest first, like the API returns them
+                f.write(json.dumps({"collection": collection, "page": {"asset_events": page[::-1]}}) + "\n")
+                page = []
+    return path
+
+
+class ReplayServer:
+    """Local stand-in for the OpenSea and Telegram APIs, serving a Recording
+
+    Set OPENSEA_API_BASE and TELEGRAM_API_BASE to url() to point the bot
+    at it. Every request waits `latency_ms` (+ up to `jitter_ms`); a share
+    `rate_limit` of requests get a 429 with Retry-After and a share
+    `timeout_rate` hang for `hang_seconds`, longer than the bot's client
+    timeouts. With `release_rate` set, events become visible that many per
+    second from start(), stamped with the time they appear, as if they
+    were being listed live; otherwise all of them are there at once.
+    """
+
+    def __init__(self, recording, latency_ms=None, jitter_ms=None, rate_limit=None, timeout_rate=None,
+                 release_rate=None, hang_seconds=30.0, retry_after=1, host="127.0.0.1", port=0, seed=0):
+        self.recording = recording
+        self.latency_ms = latency_ms if latency_ms is not None else env_float("REPLAY_LATENCY_MS", 0)
+        self.jitter_ms = jitter_ms if jitter_ms is not None else env_float("REPLAY_JITTER_MS", 0)
+        self.rate_limit = rate_limit if rate_limit is not None else env_float("REPLAY_RATE_LIMIT", 0)
+        self.timeout_rate = timeout_rate if timeout_rate is not None else env_float("REPLAY_TIMEOUT_RATE", 0)
+        self.release_rate = release_rate if release_rate is not None else env_float("REPLAY_RELEASE_RATE", 0)
+        self.hang_seconds = hang_seconds
+        self.retry_after = retry_after
+        self.host = host
+        self.port = port
+        self.random = random.Random(seed)
+        self.timestamps = {}
+        self.runner = None
+        self.started_at = None
+        # Stats
+        self.requests = 0
+        self.rate_limited = 0
+        self.timeouts = 0
+        self.events_served = 0
+        self.metadata_served = 0
+        self.messages = 0
+
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    @web.middleware
+    async def faults(self, request, handler):
+        self.requests += 1
+        delay = self.latency_ms + self.random.random() * self.jitter_ms
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+        if self.timeout_rate and self.random.random() < self.timeout_rate:
+            self.timeouts += 1
+            await asyncio.sleep(self.hang_seconds)
+            return web.Response(status=504)
+        if self.rate_limit and self.random.random() < self.rate_limit:
+            self.rate_limited += 1
+            return web.json_response({"detail": "Request was throttled."}, status=429,
+                                     headers={"Retry-After": str(self.retry_after)})
+        return await handler(request)
+
+    def _released(self, collection):
+        """Number of a collection's events visible now and the timestamp of event i"""
+        events = self.recording.events.get(collection, [])
+        if self.release_rate <= 0:
+            timestamps = self.timestamps[collection]
+            return len(events), timestamps.__getitem__
+        started_at = self.started_at
+        rate = self.release_rate
+        count = min(len(events), int((time.time() - started_at) * rate))
+        return count, lambda number: int(started_at + number / rate)
+
+    async def events(self, request):
+        collection = request.query.get("collection_slug", "")
+        events = self.recording.events.get(collection, [])
+        limit = min(int(request.query.get("limit", 50)), 200)
+        count, timestamp = self._released(collection)
+        first = 0
+        if "after" in request.query:
+            first = bisect_left(range(count), int(request.query["after"]), key=timestamp)
+        # Newest first; the cursor is the position to continue below, so it stays valid as events are released
+        stop = min(int(request.query.get("next") or count), count)
+        start = max(first, stop - limit)
+        page = []
+        for number in range(stop - 1, start - 1, -1):
+            event = events[number]
+            if self.release_rate > 0:
+                event = {**event, "event_timestamp": timestamp(number)}
+            page.append(event)
+        self.events_served += len(page)
+        data = {"asset_events": page}
+        if start > first:
+            data["next"] = str(start)
+        return web.json_response(data)
+
+    async def asset(self, request):
+        key = (request.match_info["contract"].lower(), request.match_info["token_id"])
+        data = self.recording.metadata.get(key)
+        if data is None:
+            return web.json_response({"errors": ["Not found"]}, status=404)
+        self.metadata_served += 1
+        return web.json_response(data)
+
+    async def stats(self, request):
+        data = self.recording.stats.get(request.match_info["slug"])
+        if data is None:
+            return web.json_response({"errors": ["Not found"]}, status=404)
+        return web.json_response(data)
+
+    async def traits(self, request):
+        data = self.recording.traits.get(request.match_info["slug"])
+        if data is None:
+            return web.json_response({"errors": ["Not found"]}, status=404)
+        return web.json_response(data)
+
+    async def send_message(self, request):
+        await request.post()
+        self.messages += 1
+        return web.json_response({"ok": True, "result": {"message_id": self.messages}})
+
+    async def start(self):
+        """Start serving; returns url()"""
+        self.timestamps = {}
+        from ingest import event_timestamp
+
+        for collection, events in self.recording.events.items():
+            self.timestamps[collection] = [event_timestamp(event) for event in events]
+        app = web.Application(middlewares=[self.faults])
+        app.router.add_get("/api/v2/events", self.events)
+        app.router.add_get("/api/v2/asset/{contract}/{token_id}", self.asset)
+        app.router.add_get("/api/v2/collection/{slug}/stats", self.stats)
+        app.router.add_get("/api/v2/traits/{slug}", self.traits)
+        app.router.add_post("/bot{token}/sendMessage", self.send_message)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.port = self.runner.addresses[0][1]
+        self.started_at = time.time()
+        return self.url()
+
+    async def close(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+            self.runner = None
+
+    def served(self):
+        return {
+            "requests": self.requests,
+            "rate_limited": self.rate_limited,
+            "timeouts": self.timeouts,
+            "events": self.events_served,
+            "metadata": self.metadata_served,
+            "messages": self.messages,
+        }
+
+
+async def serve(path, port):
+    server = ReplayServer(Recording.load(path), port=port)
+    url = await server.start()
+    print(f"✅ Serving {server.recording.listings()} recorded listings at {url}")
+    print(f"   Run the bot with OPENSEA_API_BASE={url} TELEGRAM_API_BASE={url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+
+if __name__ == "__main__":
+    # python replay.py serve <dir> [port]  /  synth <dir> [tokens] [listings]
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    if command == "serve" and len(sys.argv) > 2:
+        try:
+            asyncio.run(serve(sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else env_int("REPLAY_PORT", 8765)))
+        except KeyboardInterrupt:
+            pass
+    elif command == "synth" and len(sys.argv) > 2:
+        tokens = int(sys.argv[3]) if len(sys.argv) > 3 else 10000
+        listings = int(sys.argv[4]) if len(sys.argv) > 4 else 100000
+        synthesize(sys.argv[2], tokens=tokens, listings=listings)
+        print(f"✅ Wrote {listings} listings of {tokens} tokens to {sys.argv[2]}")
+    else:
+        print("Usage: python replay.py serve <dir> [port]  |  synth <dir> [tokens] [listings]")
+        sys.exit(1)
@@ -0,0 +1,126 @@
+import asyncio
+import time
+from config import env_float
+
+
+class PollScheduler:
+    """Shared OpenSea request budget for every poller of the bot
+
+    Every request (event pages, metadata lookups, crawls) draws from a
+    token bucket refilled at `rate` requests per second, and a 429 pauses
+    all requests until its Retry-After expires. Waiters are served in
+    arrival order, so collections sharing the budget take turns fairly.
+    Each poller gets its own adaptive PollCadence from cadence().
+    """
+
+    def __init__(self, min_interval=None, max_interval=None, rate=None, burst=None, initial_interval=3.0):
+        self.min_interval = min_interval if min_interval is not None else env_float("POLL_MIN_INTERVAL", 1.0)
+        self.max_interval = max_interval if max_interval is not None else env_float("POLL_MAX_INTERVAL", 15.0)
+        self.initial_interval = initial_interval
+        self.rate = rate if rate is not None else env_float("OPENSEA_RATE_LIMIT", 2.0)
+        self.burst = burst if burst is not None else env_float("OPENSEA_RATE_BURST", 10.0)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.cooldown_until = 0.0
+        self._turn = asyncio.Lock()
+        # Stats
+        self.requests = 0
+        self.rate_limited = 0
+
+    def cadence(self):
+        """New adaptive poll interval bound to this budget"""
+        return PollCadence(self)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return now
+
+    def wait_time(self, cost=1):
+        """Seconds until `cost` requests may be made"""
+        now = self._refill()
+        deficit = max(0.0, cost - self.tokens)
+        return max(self.cooldown_until - now, deficit / self.rate if self.rate > 0 else 0.0, 0.0)
+
+    async def acquire(self, cost=1):
+        """Wait for budget, then spend `cost` requests from it"""
+        async with self._turn:
+            while True:
+                delay = self.wait_time(cost)
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+            self.tokens -= cost
+            self.requests += cost
+
+    def record_rate_limited(self, retry_after=None):
+        """Pause all requests after a 429, honouring Retry-After when given"""
+        self.rate_limited += 1
+        pause = retry_after if retry_after is not None else max(self.min_interval, 5.0)
+        self.cooldown_until = max(self.cooldown_until, time.monotonic() + pause)
+        self.tokens = min(self.tokens, 0.0)
+
+    def stats(self):
+        self._refill()
+        return {
+            "budget": round(self.tokens, 2),
+            "budget_capacity": self.burst,
+            "rate": self.rate,
+            "cooldown": round(max(0.0, self.cooldown_until - time.monotonic()), 2),
+            "requests": self.requests,
+            "rate_limited": self.rate_limited,
+        }
+
+
+class PollCadence:
+    """Adaptive poll interval of one poller
+
+    The interval shrinks while pages come back full of new listings and
+    grows while they come back empty, within the scheduler's bounds, and
+    is never shorter than the time the shared budget needs to allow the
+    next request.
+    """
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.interval = self._clamp(scheduler.initial_interval)
+        self.errors = 0
+
+    def _clamp(self, interval):
+        return min(max(interval, self.scheduler.min_interval), self.scheduler.max_interval)
+
+    def record_poll(self, new_events, page_size):
+        """Adapt the interval to how many new listings the last poll found
+
+        Only new listings speed polling up; a poll that paged further but
+        found nothing new (e.g. listings at the cursor boundary) slows down
+        like any idle poll.
+        """
+        if new_events >= page_size:
+            self.interval = self._clamp(self.interval * 0.5)
+        elif new_events > 0:
+            self.interval = self._clamp(self.interval * 0.8)
+        else:
+            self.interval = self._clamp(self.interval * 1.5)
+
+    def record_error(self):
+        self.errors += 1
+        self.interval = self._clamp(max(self.interval * 2, 5.0))
+
+    def record_rate_limited(self, retry_after=None):
+        self.interval = self._clamp(self.interval * 2)
+        self.scheduler.record_rate_limited(retry_after)
+
+    def next_delay(self):
+        """Seconds to sleep before the next poll"""
+        return max(self.interval, self.scheduler.wait_time())
+
+    def stats(self):
+        stats = self.scheduler.stats()
+        stats.update({
+            "interval": round(self.interval, 2),
+            "next_delay": round(self.next_delay(), 2),
+            "errors": self.errors,
+        })
+        return stats
@@ -0,0 +1,354 @@
+import math
+
+try:
+    import numpy as np
+except ImportError:  # optional: batch scoring falls back to plain Python
+    np = None
+
+# Cell of a TraitMatrix for a trait type the token does not have
+MISSING = -1
+DEFAULT_FORMULA = "average_inverse"
+
+
+class TraitMatrix:
+    """Encoded traits of many tokens, one row per token
+
+    Column c holds the trait id the token has for trait type c, or
+    MISSING. Tokens carrying several values of one type spill the extra
+    ids into overflow columns past the last trait type. Rows are a NumPy
+    int32 array when NumPy is available, else lists.
+    """
+
+    def __init__(self, keys, rows, width, type_count):
+        self.keys = keys
+        self.rows = rows
+        self.width = width
+        self.type_count = type_count
+
+    @classmethod
+    def from_index(cls, index, keys=None):
+        """Matrix of the given (default: all) tokens of a RarityIndex's table"""
+        keys = index.token_keys() if keys is None else keys
+        return cls.from_ids(index, keys, [index.token_trait_ids(key) or () for key in keys])
+
+    @classmethod
+    def from_traits(cls, index, traits_list):
+        """Matrix of not yet tabled tokens, from their OpenSea traits"""
+        return cls.from_ids(index, list(range(len(traits_list))), [index.encode(traits) for traits in traits_list])
+
+    @classmethod
+    def from_ids(cls, index, keys, id_rows):
+        type_count = len(index.trait_types)
+        trait_columns = index.trait_columns
+        row_index, column_index, values = [], [], []
+        width = type_count
+        for row, trait_ids in enumerate(id_rows):
+            used = set()
+            overflow = type_count
+            for trait_id in trait_ids:
+                column = trait_columns[trait_id]
+                if column in used:
+                    while overflow in used:
+                        overflow += 1
+                    column = overflow
+                used.add(column)
+                row_index.append(row)
+                column_index.append(column)
+                values.append(trait_id)
+            if used:
+                width = max(width, max(used) + 1)
+        if np is not None:
+            rows = np.full((len(keys), width), MISSING, dtype=np.int32)
+            rows[row_index, column_index] = values
+        else:
+            rows = [[MISSING] * width for _ in keys]
+            for row, column, trait_id in zip(row_index, column_index, values):
+                rows[row][column] = trait_id
+        return cls(keys, rows, width, type_count)
+
+    def __len__(self):
+        return len(self.keys)
+
+
+BATCH_FORMULAS = {}
+
+
+def batch_formula(name):
+    """Register a batch scoring formula under `name`
+
+    A formula takes the n x columns matrix of per-cell inverse frequencies
+    (1 / occurrence, 0 for MISSING or unknown traits) and returns one
+    relative score per row; scores are scaled by the total supply after.
+    """
+    def register(function):
+        BATCH_FORMULAS[name] = function
+        return function
+    return register
+
+
+@batch_formula(DEFAULT_FORMULA)
+def average_inverse_frequency(inverse):
+    """Average inverse frequency of the known traits, like calculate_rarity_score"""
+    counts = (inverse > 0).sum(axis=1)
+    return np.where(counts > 0, inverse.sum(axis=1) / np.maximum(counts, 1), 0.0)
+
+
+def inverse_matrix(index, matrix):
+    """Per-cell inverse frequencies of a TraitMatrix (0 for MISSING)"""
+    # MISSING (-1) indexes the trailing 0 weight
+    weights = np.append(np.frombuffer(index.inverse, dtype=np.float64), 0.0)
+    return weights[matrix.rows]
+
+
+def relative_scores(index, matrix, formula=DEFAULT_FORMULA):
+    """Scores of every row before scaling by supply"""
+    if np is None:
+        if formula != DEFAULT_FORMULA:
+            raise RuntimeError(f"Scoring formula {formula!r} needs NumPy")
+        return [index._relative_score([trait_id for trait_id in row if trait_id != MISSING]) for row in matrix.rows]
+    return BATCH_FORMULAS[formula](inverse_matrix(index, matrix))
+
+
+def score_batch(index, matrix, formula=DEFAULT_FORMULA):
+    """Rarity scores of every row of a TraitMatrix, rounded like single scores"""
+    scores = relative_scores(index, matrix, formula)
+    supply = index.total_supply
+    if np is None:
+        return [round(score * supply, 2) for score in scores]
+    return [round(score, 2) for score in (scores * supply).tolist()]
+
+
+class ScoringEngine:
+    """A rarity model precomputed against a RarityIndex
+
+    prepare() derives per-trait weights from the index's counts and
+    supply; score_ids() then scores one encoded token and score_matrix()
+    a whole TraitMatrix, so the model costs nothing extra per listing.
+    Higher scores are rarer in every model.
+    """
+
+    name = None
+
+    def prepare(self, index):
+        self.index = index
+        return self
+
+    def score_ids(self, trait_ids):
+        raise NotImplementedError
+
+    def score_matrix(self, matrix):
+        return [self.score_ids([trait_id for trait_id in row if trait_id != MISSING]) for row in matrix.rows]
+
+
+class AverageInverseEngine(ScoringEngine):
+    """The original model: average inverse frequency of the known traits
+
+    COLLECTION_THRESHOLDS are tuned against its absolute values.
+    """
+
+    name = DEFAULT_FORMULA
+
+    def score_ids(self, trait_ids):
+        return self.index.score_ids(trait_ids)
+
+    def score_matrix(self, matrix):
+        return score_batch(self.index, matrix)
+
+
+class AdditiveEngine(ScoringEngine):
+    """Models that add up one weight per trait type, plus a trait count weight
+
+    Trait types a token lacks count as a "none" value whose frequency is
+    the share of the supply without that type. Subclasses set the weight
+    of a frequency (`weight`), whether the number of traits is itself a
+    trait (`trait_count`), and the final transform of the sum.
+    """
+
+    trait_count = False
+
+    def weight(self, probability):
+        raise NotImplementedError
+
+    def transform(self, total):
+        return total
+
+    def _weight_or_zero(self, occurrence, supply):
+        if occurrence <= 0 or supply <= 0:
+            return 0.0
+        return self.weight(min(occurrence / supply, 1.0))
+
+    def prepare(self, index):
+        super().prepare(index)
+        supply = index.total_supply or 0
+        self.trait_weights = [self._weight_or_zero(count, supply) for count in index.counts]
+        type_totals = [0] * len(index.trait_types)
+        for column, count in zip(index.trait_columns, index.counts):
+            type_totals[column] += count
+        # A type everybody has makes lacking it as rare as a single token
+        self.missing_weights = [
+            self._weight_or_zero(max(supply - total, 1), supply) for total in type_totals
+        ]
+        self.count_weights = {}
+        if self.trait_count:
+            distribution = {}
+            for key in index.token_keys():
+                size = len(index.token_trait_ids(key))
+                distribution[size] = distribution.get(size, 0) + 1
+            tokens = sum(distribution.values())
+            self.count_weights = {
+                size: self._weight_or_zero(count, tokens) for size, count in distribution.items()
+            }
+        return self
+
+    def score_ids(self, trait_ids):
+        trait_columns = self.index.trait_columns
+        missing = self.missing_weights
+        present = set()
+        total = 0.0
+        for trait_id in trait_ids:
+            total += self.trait_weights[trait_id]
+            present.add(trait_columns[trait_id])
+        total += sum(weight for column, weight in enumerate(missing) if column not in present)
+        total += self.count_weights.get(len(trait_ids), 0.0)
+        return round(float(self.transform(total)), 4)
+
+    def score_matrix(self, matrix):
+        if np is None:
+            return super().score_matrix(matrix)
+        rows = matrix.rows
+        types = matrix.type_count
+        weights = np.append(np.asarray(self.trait_weights, dtype=np.float64), 0.0)
+        typed = rows[:, :types]
+        present = typed != MISSING
+        totals = weights[rows].sum(axis=1)
+        totals += (~present * np.asarray(self.missing_weights, dtype=np.float64)).sum(axis=1)
+        if self.count_weights:
+            sizes = (rows != MISSING).sum(axis=1)
+            lookup = np.zeros(max(max(self.count_weights), int(sizes.max(initial=0))) + 1)
+            for size, weight in self.count_weights.items():
+                lookup[size] = weight
+            totals += lookup[sizes]
+        return [round(score, 4) for score in self.transform(totals).tolist()]
+
+
+class StatisticalEngine(AdditiveEngine):
+    """Statistical rarity: 1 / probability of the token's exact trait combination"""
+
+    name = "statistical"
+
+    def weight(self, probability):
+        return -math.log(probability)
+
+    def transform(self, total):
+        return np.exp(total) if np is not None and not isinstance(total, float) else math.exp(total)
+
+
+class InformationContentEngine(AdditiveEngine):
+    """Information content of the traits in bits, over the collection's entropy"""
+
+    name = "information_content"
+
+    def prepare(self, index):
+        super().prepare(index)
+        supply = index.total_supply or 0
+        entropy = 0.0
+        if supply > 0:
+            probabilities = [count / supply for count in index.counts if count > 0]
+            type_totals = {}
+            for column, count in zip(index.trait_columns, index.counts):
+                type_totals[column] = type_totals.get(column, 0) + count
+            probabilities += [(supply - total) / supply for total in type_totals.values() if total < supply]
+            entropy = -sum(p * math.log2(p) for p in probabilities if 0 < p <= 1)
+        self.entropy = entropy
+        return self
+
+    def weight(self, probability):
+        return -math.log2(probability)
+
+    def transform(self, total):
+        return total / self.entropy if self.entropy > 0 else total
+
+
+class TraitCountEngine(AdditiveEngine):
+    """rarity.tools style: sum of inverse frequencies, with missing traits and trait count"""
+
+    name = "trait_count"
+    trait_count = True
+
+    def weight(self, probability):
+        return 1 / probability
+
+
+ENGINES = {
+    engine.name: engine
+    for engine in (AverageInverseEngine, StatisticalEngine, InformationContentEngine, TraitCountEngine)
+}
+
+
+def make_engine(name=None):
+    """Scoring engine by name (default: the original average inverse model)"""
+    name = (name or DEFAULT_FORMULA).strip().lower()
+    if name not in ENGINES:
+        raise ValueError(f"Unknown scoring model {name!r} (choose from {', '.join(ENGINES)})")
+    return ENGINES[name]()
+
+
+class ScoreThreshold:
+    """Alert threshold: an absolute score, a percentile or a rank
+
+    "150" is a score; "95%" or "top 5%" a percentile (at least as rare as
+    95% of the collection); "top 100" a rank. Percentiles and ranks mean
+    the same in every scoring model.
+    """
+
+    def __init__(self, value, percentile=False, rank=False):
+        self.value = value
+        self.percentile = percentile
+        self.rank = rank
+
+    @property
+    def relative(self):
+        """Whether checking it needs the token's standing in the collection"""
+        return self.percentile or self.rank
+
+    @classmethod
+    def parse(cls, text):
+        """ScoreThreshold from "150", "150.5", "95%", "top 5%" or "top 100" (None if unparseable)"""
+        if isinstance(text, ScoreThreshold):
+            return text
+        if isinstance(text, (int, float)):
+            return cls(text)
+        text = str(text).strip().lower()
+        top = text.startswith("top")
+        if top:
+            text = text[3:].strip()
+        percentile = text.endswith("%")
+        try:
+            value = float(text.rstrip("%").strip())
+        except ValueError:
+            return None
+        if percentile:
+            value = min(max(value, 0.0), 100.0)
+            return cls(100.0 - value if top else value, percentile=True)
+        if top:
+            return cls(max(int(value), 1), rank=True)
+        return cls(int(value) if value.is_integer() else value)
+
+    def passes(self, score, percentile=None, rank=None):
+        if self.percentile:
+            return percentile is not None and percentile >= self.value
+        if self.rank:
+            return rank is not None and rank <= self.value
+        return score >= self.value
+
+    def __eq__(self, other):
+        if isinstance(other, ScoreThreshold):
+            return (self.value, self.percentile, self.rank) == (other.value, other.percentile, other.rank)
+        return not self.relative and self.value == other
+
+    def __str__(self):
+        if self.percentile:
+            return f"top {100 - self.value:g}%"
+        if self.rank:
+            return f"top {self.value} by rank"
+        return str(self.value)
@@ -4,22 +4,53 @@ import subprocess
 import sys
 import io
 import os
-import requests
+from collections import deque
 from PyQt5.QtWidgets import (
     QApplication, QWidget, QLabel, QLineEdit, QPushButton, QTextEdit, QCheckBox,
     QVBoxLayout, QHBoxLayout, QFrame, QSizePolicy, QStackedWidget, QMessageBox, QSpacerItem
 )
 from PyQt5.QtGui import QFont, QTextCursor, QIcon, QPixmap
-from PyQt5.QtCore import Qt, QTimer, QProcess, QObject, pyqtSignal
+from PyQt5.QtCore import Qt, QTimer, QProcess
 from dotenv import dotenv_values
-from bot_core import run_bot
+from bot_core import run_bot, StopEvent
+from http_client import http_session
+from latency import format_latency, latency_stats
 
 APP_VERSION = "1.0.0"
 GITHUB_VERSION_URL = "https://raw.githubusercontent.com/usamaabbasi01/nft_sniper_bot/main/version.txt"
 GITHUB_UPDATE_BASE_URL = "https://raw.githubusercontent.com/usamaabbasi01/nft_sniper_bot/main/"
+# How often bot logs are moved into the output box, and how many lines it keeps
+LOG_FLUSH_INTERVAL_MS = 100
+LOG_MAX_LINES = 5000
+LATENCY_REFRESH_MS = 2000
 
-class LogSignaler(QObject):
-    log_signal = pyqtSignal(str)
+class LogBuffer:
+    """Log lines from the bot thread, waiting for the GUI thread to show them
+
+    push() is cheap and never touches Qt, so the bot can log freely; the
+    GUI drains everything on a timer and shows it in one update. At most
+    `max_lines` lines wait at a time: the oldest are dropped (and counted)
+    if the GUI falls behind a burst.
+    """
+
+    def __init__(self, max_lines=LOG_MAX_LINES):
+        self.lines = deque(maxlen=max_lines)
+        self.lock = threading.Lock()
+        self.dropped = 0
+
+    def push(self, message):
+        with self.lock:
+            if len(self.lines) == self.lines.maxlen:
+                self.dropped += 1
+            self.lines.append(message)
+
+    def drain(self):
+        """(waiting lines, lines dropped since the last drain)"""
+        with self.lock:
+            lines = list(self.lines)
+            self.lines.clear()
+            dropped, self.dropped = self.dropped, 0
+        return lines, dropped
 
 class NFTBotUI(QWidget):
     def __init__(self):
@@ -30,9 +61,14 @@ class NFTBotUI(QWidget):
         self.setMinimumSize(800, 500)
         self.setStyleSheet(self.get_stylesheet())
         self.bot_process = None
-        self.log_signaler = LogSignaler()
-        self.log_signaler.log_signal.connect(self.append_to_output)
+        self.log_buffer = LogBuffer()
         self.init_ui()
+        self.log_timer = QTimer(self)
+        self.log_timer.timeout.connect(self.flush_logs)
+        self.log_timer.start(LOG_FLUSH_INTERVAL_MS)
+        self.latency_timer = QTimer(self)
+        self.latency_timer.timeout.connect(self.update_latency)
+        self.latency_timer.start(LATENCY_REFRESH_MS)
         self.showMaximized()
         self.check_for_updates()
 
@@ -63,6 +99,11 @@ class NFTBotUI(QWidget):
             font-size: 13px;
             background-color: #232a36;
         }
+        QLabel#latencyLabel {
+            font-family: Consolas, 'Courier New', monospace;
+            font-size: 13px;
+            color: #8b949e;
+        }
         QPushButton#updateBtn {
             background: #0078D7;
             color: white;
@@ -221,9 +262,17 @@ class NFTBotUI(QWidget):
         # Output area
         self.output_box = QTextEdit()
         self.output_box.setReadOnly(True)
+        # Bounded, append-only log: no undo history, oldest lines dropped
+        self.output_box.setUndoRedoEnabled(False)
+        self.output_box.document().setMaximumBlockCount(LOG_MAX_LINES)
         self.output_box.setMinimumHeight(250)
         self.output_box.setSizePolicy(QSizePolicy.Expanding, QSizePolicy.Expanding)
         layout.addWidget(self.output_box)
+        # Listing-to-alert latency of the running bot
+        self.latency_label = QLabel("⏱ Latency: no listings yet")
+        self.latency_label.setObjectName("latencyLabel")
+        self.latency_label.setTextInteractionFlags(Qt.TextSelectableByMouse)
+        layout.addWidget(self.latency_label)
         # Controls
         controls = QHBoxLayout()
         self.start_btn = QPushButton("▶ Start Bot")
@@ -369,6 +418,20 @@ class NFTBotUI(QWidget):
         cursor.movePosition(QTextCursor.End)
         self.output_box.setTextCursor(cursor)
 
+    def update_latency(self):
+        """Show the running bot's per-step latency percentiles"""
+        lines = format_latency(latency_stats())
+        if lines:
+            self.latency_label.setText("⏱ Latency (p50 / p95 / p99)\n" + "\n".join(lines))
+
+    def flush_logs(self):
+        """Show the bot's buffered log lines in one append"""
+        lines, dropped = self.log_buffer.drain()
+        if dropped:
+            lines.insert(0, f"⚠️ {dropped} log lines skipped to keep up")
+        if lines:
+            self.append_to_output("\n".join(lines))
+
     def start_bot_process(self):
         if hasattr(self, 'bot_thread') and self.bot_thread and self.bot_thread.is_alive():
             QMessageBox.warning(
@@ -380,17 +443,14 @@ class NFTBotUI(QWidget):
         self.output_box.append("🚀 Bot started successfully!\n")
         self.output_box.append("📡 Monitoring for new NFT listings...\n")
         self.output_box.append("-" * 50 + "\n")
-        self.bot_stop_event = threading.Event()
-        def log_message(msg):
-            self.log_signaler.log_signal.emit(msg)
-        def send_alert(msg):
-            from utils import send_telegram_alert
-            send_telegram_alert(msg)
+        self.bot_stop_event = StopEvent()
+        log_message = self.log_buffer.push
         def bot_runner():
             import asyncio
             from bot_core import run_bot
+            from utils import send_telegram_alert
             try:
-                asyncio.run(run_bot(log_message, send_alert, self.bot_stop_event))
+                asyncio.run(run_bot(log_message, send_telegram_alert, self.bot_stop_event))
             except Exception as e:
                 print(f"[THREAD ERROR] {e}")
                 log_message(f"[THREAD ERROR] {e}")
@@ -415,6 +475,7 @@ class NFTBotUI(QWidget):
     def stop_bot(self):
         if hasattr(self, 'bot_stop_event'):
             self.bot_stop_event.set()
+        self.flush_logs()
         self.output_box.append("⏹ Bot stopped by user.\n")
         self.output_box.append("-" * 50 + "\n")
 
@@ -429,7 +490,7 @@ class NFTBotUI(QWidget):
 
     def check_for_updates(self):
         try:
-            resp = requests.get(GITHUB_VERSION_URL, timeout=5)
+            resp = http_session().get(GITHUB_VERSION_URL, timeout=5)
             if resp.status_code == 200:
                 latest_version = resp.text.strip()
                 if latest_version != APP_VERSION:
@@ -470,7 +531,7 @@ class NFTBotUI(QWidget):
         for fname in files_to_update:
             url = GITHUB_UPDATE_BASE_URL + fname
             try:
-                resp = requests.get(url, timeout=10)
+                resp = http_session().get(url, timeout=10)
                 if resp.status_code == 200:
                     with open(fname, "w", encoding="utf-8") as f:
                         f.write(resp.text)
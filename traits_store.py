@@ -0,0 +1,554 @@
+import asyncio
+import json
+import mmap
+import os
+import sys
+from array import array
+from collections import ChainMap
+from collections.abc import Mapping
+
+TRAITS_BINARY_FILE = "traits_cache.bin"
+TRAITS_JOURNAL_FILE = "traits_cache.journal"
+# Collection key for a legacy flat cache, which does not say which collection it describes
+ANY_COLLECTION = "*"
+BINARY_MAGIC = b"NFTTRAIT"
+BINARY_FORMAT_VERSION = 1
+# Count of a trait value that tokens carry but the collection counts lack
+UNCOUNTED = -1
+
+_PREAMBLE = len(BINARY_MAGIC) + 8
+
+
+def _align(offset, alignment=8):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+class _StringTable:
+    def __init__(self):
+        self.ids = {}
+        self.strings = []
+
+    def intern(self, value):
+        value = str(value)
+        string_id = self.ids.get(value)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.ids[value] = string_id
+            self.strings.append(value)
+        return string_id
+
+    def arrays(self):
+        data = bytearray()
+        offsets = array("I", [0])
+        for value in self.strings:
+            data += value.encode("utf-8")
+            offsets.append(len(data))
+        return offsets, array("B", data)
+
+
+def _token_pairs(traits):
+    if isinstance(traits, Mapping):
+        pairs = traits.items()
+    else:
+        pairs = ((trait.get("trait_type"), trait.get("value")) for trait in traits or [])
+    for trait_type, value in pairs:
+        if trait_type and value is not None and value != "":
+            yield trait_type, value
+
+
+def encode_traits_cache(cache):
+    """Serialize a version 3 traits cache to the binary format
+
+    Layout: magic, format version, length of a small JSON header, the
+    header, then 8-byte aligned sections of fixed-width integers. Strings
+    (trait types, values, token ids) are interned once in a shared table;
+    each collection has parallel trait arrays (type, value, count) and its
+    token table as CSR arrays (token -> slice of trait indexes).
+    """
+    strings = _StringTable()
+    sections = {}
+    collections = {}
+    for number, (slug, entry) in enumerate((cache.get("collections") or {}).items()):
+        types, values, counts = array("I"), array("I"), array("q")
+        trait_index = {}
+
+        def intern_trait(trait_type, value, count):
+            key = (str(trait_type), str(value))
+            index = trait_index.get(key)
+            if index is None:
+                index = len(types)
+                trait_index[key] = index
+                types.append(strings.intern(key[0]))
+                values.append(strings.intern(key[1]))
+                counts.append(count)
+            return index
+
+        for trait_type, trait_values in (entry.get("traits") or {}).items():
+            if isinstance(trait_values, Mapping):
+                for value, count in trait_values.items():
+                    intern_trait(trait_type, value, int(count))
+        names, offsets, members = array("I"), array("I", [0]), array("I")
+        tokens = entry.get("tokens")
+        if tokens:
+            for token_id, traits in tokens.items():
+                names.append(strings.intern(token_id))
+                members.extend(intern_trait(t, v, UNCOUNTED) for t, v in _token_pairs(traits))
+                offsets.append(len(members))
+        prefix = f"{number}."
+        sections.update({
+            prefix + "trait_types": types,
+            prefix + "trait_values": values,
+            prefix + "trait_counts": counts,
+        })
+        if tokens is not None:
+            sections.update({
+                prefix + "token_names": names,
+                prefix + "token_offsets": offsets,
+                prefix + "token_traits": members,
+            })
+        collections[slug] = {
+            "section": number,
+            "tokens": tokens is not None,
+            "meta": {key: value for key, value in entry.items() if key not in ("traits", "tokens")},
+        }
+    sections["strings.offsets"], sections["strings.data"] = strings.arrays()
+
+    layout = {}
+    position = 0
+    for name, data in sections.items():
+        layout[name] = [position, len(data), data.typecode]
+        position = _align(position + len(data) * data.itemsize)
+    header = json.dumps({
+        "version": cache.get("version"),
+        "byteorder": sys.byteorder,
+        "collections": collections,
+        "sections": layout,
+    }, separators=(",", ":")).encode("utf-8")
+
+    out = bytearray(BINARY_MAGIC)
+    out += BINARY_FORMAT_VERSION.to_bytes(4, "little") + len(header).to_bytes(4, "little") + header
+    out += bytes(_align(len(out)) - len(out))
+    data_start = len(out)
+    for name, data in sections.items():
+        out += bytes(data_start + layout[name][0] - len(out))
+        out += data.tobytes()
+    return bytes(out)
+
+
+def write_binary_traits_cache(path, cache):
+    """Write the cache in the binary format through a temp file and rename"""
+    data = encode_traits_cache(cache)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return len(data)
+
+
+class BinaryTraitsFile:
+    """Read-only view of a binary traits cache
+
+    The file is memory-mapped (read into memory on Windows, where a mapped
+    file could not be replaced by the next save), and sections are exposed
+    as typed memoryviews over it, so loading parses only the header and
+    processes sharing the file share its pages.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            if os.name == "nt":
+                self._buffer = f.read()
+            else:
+                self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._buffer)
+        if len(view) < _PREAMBLE or bytes(view[:len(BINARY_MAGIC)]) != BINARY_MAGIC:
+            raise ValueError(f"{path} is not a binary traits cache")
+        version = int.from_bytes(view[8:12], "little")
+        if version != BINARY_FORMAT_VERSION:
+            raise ValueError(f"unsupported binary traits cache format {version}")
+        header_length = int.from_bytes(view[12:16], "little")
+        self.header = json.loads(bytes(view[_PREAMBLE:_PREAMBLE + header_length]))
+        self._data_start = _align(_PREAMBLE + header_length)
+        self._view = view
+        self._native = self.header.get("byteorder") == sys.byteorder
+        self._strings = {}
+        self.string_offsets = self.section("strings.offsets")
+        self.string_data = self.section("strings.data")
+
+    def section(self, name):
+        offset, length, typecode = self.header["sections"][name]
+        itemsize = array(typecode).itemsize
+        start = self._data_start + offset
+        raw = self._view[start:start + length * itemsize]
+        if len(raw) != length * itemsize:
+            raise ValueError(f"binary traits cache is truncated in section {name}")
+        if self._native:
+            return raw.cast(typecode)
+        data = array(typecode, raw.tobytes())
+        data.byteswap()
+        return data
+
+    def string(self, string_id):
+        value = self._strings.get(string_id)
+        if value is None:
+            offsets = self.string_offsets
+            value = bytes(self.string_data[offsets[string_id]:offsets[string_id + 1]]).decode("utf-8")
+            self._strings[string_id] = value
+        return value
+
+    def cache(self):
+        """The file as a version 3 traits cache of lazily decoded entries"""
+        return {
+            "version": self.header.get("version"),
+            "collections": {
+                slug: BinaryCollection(self, info) for slug, info in self.header["collections"].items()
+            },
+        }
+
+
+class BinaryCollection(Mapping):
+    """Traits cache entry of one collection, backed by a BinaryTraitsFile"""
+
+    def __init__(self, store, info):
+        self.store = store
+        self.meta = info.get("meta") or {}
+        prefix = f"{info['section']}."
+        self.trait_types = store.section(prefix + "trait_types")
+        self.trait_values = store.section(prefix + "trait_values")
+        self.trait_counts = store.section(prefix + "trait_counts")
+        self._tokens = BinaryTokenTable(self, prefix) if info.get("tokens") else None
+        self._traits = None
+
+    def trait_pairs(self):
+        string = self.store.string
+        return [(string(t), string(v)) for t, v in zip(self.trait_types, self.trait_values)]
+
+    def traits(self):
+        if self._traits is None:
+            counts = {}
+            for (trait_type, value), count in zip(self.trait_pairs(), self.trait_counts):
+                if count != UNCOUNTED:
+                    counts.setdefault(trait_type, {})[value] = count
+            self._traits = counts
+        return self._traits
+
+    def _keys(self):
+        keys = list(self.meta)
+        keys.append("traits")
+        if self._tokens is not None:
+            keys.append("tokens")
+        return keys
+
+    def __getitem__(self, key):
+        if key == "traits":
+            return self.traits()
+        if key == "tokens" and self._tokens is not None:
+            return self._tokens
+        return self.meta[key]
+
+    def __iter__(self):
+        return iter(self._keys())
+
+    def __len__(self):
+        return len(self._keys())
+
+
+class BinaryTokenTable(Mapping):
+    """{token_id: {trait_type: value}} view over a collection's CSR token arrays"""
+
+    def __init__(self, collection, prefix):
+        self.collection = collection
+        store = collection.store
+        self.names = store.section(prefix + "token_names")
+        self.offsets = store.section(prefix + "token_offsets")
+        self.members = store.section(prefix + "token_traits")
+        self._rows = None
+
+    def _decode(self, row):
+        collection = self.collection
+        string = collection.store.string
+        traits = {}
+        for index in self.members[self.offsets[row]:self.offsets[row + 1]]:
+            traits[string(collection.trait_types[index])] = string(collection.trait_values[index])
+        return traits
+
+    def encoded(self):
+        """(token_id, trait indexes) of every token, without decoding traits"""
+        string = self.collection.store.string
+        offsets, members = self.offsets, self.members
+        for row, name in enumerate(self.names):
+            yield string(name), members[offsets[row]:offsets[row + 1]]
+
+    def trait_pairs(self):
+        return self.collection.trait_pairs()
+
+    def __getitem__(self, token_id):
+        if self._rows is None:
+            string = self.collection.store.string
+            self._rows = {string(name): row for row, name in enumerate(self.names)}
+        return self._decode(self._rows[str(token_id)])
+
+    def __iter__(self):
+        string = self.collection.store.string
+        return (string(name) for name in self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def items(self):
+        string = self.collection.store.string
+        return [(string(name), self._decode(row)) for row, name in enumerate(self.names)]
+
+
+def load_binary_traits_cache(path=TRAITS_BINARY_FILE):
+    """Open a binary traits cache; raises FileNotFoundError or ValueError"""
+    return BinaryTraitsFile(path).cache()
+
+
+def plain_traits_cache(cache):
+    """Copy of a traits cache made of plain dicts, e.g. for JSON export"""
+    collections = {}
+    for slug, entry in (cache.get("collections") or {}).items():
+        plain = dict(entry)
+        plain["traits"] = {trait_type: dict(values) for trait_type, values in (entry.get("traits") or {}).items()}
+        if entry.get("tokens") is not None:
+            plain["tokens"] = {token_id: dict(traits) for token_id, traits in entry["tokens"].items()}
+        collections[slug] = plain
+    return {"version": cache.get("version"), "collections": collections}
+
+
+def export_traits_cache_json(cache, path):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(plain_traits_cache(cache), f, indent=2, ensure_ascii=False)
+
+
+def apply_delta(cache, record):
+    """Apply one journal record to a version 3 traits cache
+
+    Records only ever set values (scalar fields, trait counts, token
+    traits), so applying one twice is harmless.
+    """
+    collections = cache.setdefault("collections", {})
+    entry = dict(collections.get(record["c"]) or {})
+    entry.update(record.get("set") or {})
+    if record.get("counts"):
+        traits = {trait_type: dict(values) for trait_type, values in (entry.get("traits") or {}).items()}
+        for trait_type, values in record["counts"].items():
+            traits.setdefault(trait_type, {}).update(values)
+        entry["traits"] = traits
+    if record.get("tokens"):
+        tokens = entry.get("tokens")
+        if isinstance(tokens, ChainMap):
+            tokens.maps[0].update(record["tokens"])
+        elif tokens:
+            entry["tokens"] = ChainMap(dict(record["tokens"]), tokens)
+        else:
+            entry["tokens"] = dict(record["tokens"])
+    collections[record["c"]] = entry
+
+
+def snapshot_cache(cache):
+    """Copy of a traits cache that later apply_delta() calls leave unchanged
+
+    Entries are replaced rather than changed, except the newest token layer,
+    which is the only part copied.
+    """
+    collections = {}
+    for slug, entry in (cache.get("collections") or {}).items():
+        tokens = entry.get("tokens")
+        if isinstance(tokens, ChainMap):
+            entry = {**entry, "tokens": ChainMap(dict(tokens.maps[0]), *tokens.maps[1:])}
+        collections[slug] = entry
+    return {**cache, "collections": collections}
+
+
+class TraitsCacheStore:
+    """Crash-safe persistence of the traits cache
+
+    The cache lives in a binary base file that is only ever replaced
+    atomically (temp file + rename), plus an append-only journal of
+    deltas (changed fields, trait counts, new tokens) so an update costs
+    O(delta). A torn last journal line is dropped on load. Once the journal
+    outgrows `compact_ratio` of the base file (and `compact_min_bytes`),
+    base and journal are compacted into a new base.
+
+    Called on an event loop, the in-memory cache changes at once but the
+    file writes (and their fsyncs) run in a worker thread, one after the
+    other in call order; flush() waits for them and `on_error` hears of a
+    failed one. Elsewhere they happen before the call returns.
+    """
+
+    def __init__(self, path=TRAITS_BINARY_FILE, journal_path=TRAITS_JOURNAL_FILE,
+                 compact_min_bytes=256 * 1024, compact_ratio=0.5):
+        self.path = path
+        self.journal_path = journal_path
+        self.compact_min_bytes = compact_min_bytes
+        self.compact_ratio = compact_ratio
+        self.cache = {"version": None, "collections": {}}
+        self.base_size = 0
+        self.journal_size = 0
+        self.on_error = None
+        self._writing = None
+        # Stats
+        self.replayed = 0
+        self.appended = 0
+        self.compactions = 0
+        self.write_errors = 0
+
+    def load_base(self):
+        """Base file as a traits cache; raises FileNotFoundError or ValueError"""
+        cache = load_binary_traits_cache(self.path)
+        self.base_size = os.path.getsize(self.path)
+        return cache
+
+    def open(self, cache):
+        """Adopt a loaded base cache and replay the journal onto it"""
+        self.cache = cache
+        good = 0
+        try:
+            with open(self.journal_path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break
+                    apply_delta(cache, record)
+                    good += len(line)
+                    self.replayed += 1
+            if good != os.path.getsize(self.journal_path):
+                # Cut a torn tail so the next record starts on a clean line
+                with open(self.journal_path, "r+b") as f:
+                    f.truncate(good)
+        except FileNotFoundError:
+            pass
+        self.journal_size = good
+        return cache
+
+    def update(self, collection_slug, fields=None, counts=None, tokens=None):
+        """Record a delta for one collection; returns True if it triggered a compaction"""
+        record = {"c": collection_slug}
+        if fields:
+            record["set"] = fields
+        if counts:
+            record["counts"] = counts
+        if tokens:
+            record["tokens"] = {str(token_id): traits for token_id, traits in tokens.items()}
+        if len(record) == 1:
+            return False
+        line = (json.dumps(record, separators=(",", ":"), ensure_ascii=False) + "\n").encode("utf-8")
+        self._write(self._append_journal, line)
+        self.journal_size += len(line)
+        self.appended += 1
+        apply_delta(self.cache, record)
+        if self.journal_size >= max(self.compact_min_bytes, self.base_size * self.compact_ratio):
+            self.compact()
+            return True
+        return False
+
+    def adopt_legacy(self, collection_slug):
+        """Move the entry of a cache that predates collections ("*") to `collection_slug`
+
+        Only right when the bot watches that single collection. Changes
+        already journaled for the slug are kept on top of the legacy data.
+        Returns True if there was an entry to move.
+        """
+        collections = self.cache.setdefault("collections", {})
+        legacy = collections.pop(ANY_COLLECTION, None)
+        if legacy is None:
+            return False
+        entry = dict(legacy)
+        for key, value in (collections.get(collection_slug) or {}).items():
+            if key == "traits":
+                traits = {trait_type: dict(values) for trait_type, values in (legacy.get("traits") or {}).items()}
+                for trait_type, values in value.items():
+                    traits.setdefault(trait_type, {}).update(values)
+                entry["traits"] = traits
+            elif key == "tokens" and legacy.get("tokens"):
+                layers = value.maps if isinstance(value, ChainMap) else [value]
+                entry["tokens"] = ChainMap(*layers, legacy["tokens"])
+            else:
+                entry[key] = value
+        collections[collection_slug] = entry
+        self.compact()
+        return True
+
+    def replace(self, collection_slug, entry):
+        """Store a whole collection entry (e.g. a fresh crawl) and compact"""
+        self.cache.setdefault("collections", {})[collection_slug] = entry
+        self.compact()
+
+    def compact(self, cache=None):
+        """Write the cache as a new base file and empty the journal"""
+        if cache is not None:
+            self.cache = cache
+        self._write(self._write_base, snapshot_cache(self.cache))
+        self.journal_size = 0
+        self.compactions += 1
+        return self.base_size
+
+    def _append_journal(self, line):
+        with open(self.journal_path, "ab") as f:
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _write_base(self, cache):
+        self.base_size = write_binary_traits_cache(self.path, cache)
+        with open(self.journal_path, "wb"):
+            pass
+
+    def _write(self, job, *args):
+        """Run a file write now, or on an event loop queue it for the worker thread"""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            job(*args)
+            return
+        self._writing = asyncio.ensure_future(self._write_after(self._writing, job, args))
+
+    async def _write_after(self, previous, job, args):
+        if previous is not None:
+            await previous
+        try:
+            await asyncio.to_thread(job, *args)
+        except Exception as e:
+            self.write_errors += 1
+            if self.on_error is not None:
+                self.on_error(e)
+
+    async def flush(self):
+        """Wait until the writes queued so far are on disk"""
+        if self._writing is not None:
+            await self._writing
+
+    def stats(self):
+        return {
+            "base_bytes": self.base_size,
+            "journal_bytes": self.journal_size,
+            "replayed": self.replayed,
+            "appended": self.appended,
+            "compactions": self.compactions,
+            "write_errors": self.write_errors,
+        }
+
+
+if __name__ == "__main__":
+    # python traits_store.py export [traits_cache.json]  /  import [traits_cache.json]
+    from utils import TRAITS_CACHE_FILE, load_traits_cache, upgrade_traits_cache
+
+    command = sys.argv[1] if len(sys.argv) > 1 else ""
+    json_path = sys.argv[2] if len(sys.argv) > 2 else TRAITS_CACHE_FILE
+    if command == "export":
+        export_traits_cache_json(load_traits_cache(), json_path)
+        print(f"✅ Exported {TRAITS_BINARY_FILE} to {json_path}")
+    elif command == "import":
+        with open(json_path, "r", encoding="utf-8") as f:
+            size = TraitsCacheStore().compact(upgrade_traits_cache(json.load(f)))
+        print(f"✅ Imported {json_path} into {TRAITS_BINARY_FILE} ({size} bytes)")
+    else:
+        print("Usage: python traits_store.py export|import [traits_cache.json]")
+        sys.exit(1)
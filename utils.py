@@ -69,11 +69,19 @@
 
 
 import requests
+import aiohttp
+import asyncio
 import json
 import os
 import sys
 import io
 from datetime import datetime
+from scheduler import PollScheduler
+from config import env_int
+from http_client import http_session, create_session, opensea_url, telegram_url
+from logs import get_log
+from replay import RECORDER
+from traits_store import ANY_COLLECTION, TRAITS_BINARY_FILE, TraitsCacheStore
 
 # Set UTF-8 encoding for stdout/stderr (safe for PyInstaller)
 try:
@@ -83,11 +91,12 @@ try:
         sys.stderr = io.TextIOWrapper(sys.stderr.detach(), encoding='utf-8')
 except Exception:
     pass  # Ignore errors in frozen/GUI mode
+LOG = get_log("utils")
+
 
 def log_message(message):
-    """Print timestamped log message"""
-    timestamp = datetime.now().strftime("%H:%M:%S")
-    print(f"[{timestamp}] {message}")
+    """Log a message through the bot's logger (see logs.py)"""
+    LOG(message)
 
 def send_telegram_alert(message):
     """Send alert message to Telegram"""
@@ -98,7 +107,7 @@ def send_telegram_alert(message):
         log_message("❌ Telegram token or user ID is missing.")
         return None
 
-    url = f"https://api.telegram.org/bot{token}/sendMessage"
+    url = telegram_url(f"/bot{token}/sendMessage")
     data = {
         "chat_id": user_id,
         "text": message,
@@ -107,7 +116,7 @@ def send_telegram_alert(message):
     }
 
     try:
-        response = requests.post(url, data=data, timeout=10)
+        response = http_session().post(url, data=data, timeout=10)
         if response.status_code == 200:
             log_message("✅ Telegram alert sent successfully")
             return response
@@ -122,10 +131,8 @@ def send_telegram_alert(message):
         return None
 
 
-def fetch_metadata(token_id, contract_address):
-    """Fetch NFT metadata from OpenSea API"""
-    url = f"https://api.opensea.io/api/v2/asset/{contract_address}/{token_id}"
-    
+def opensea_headers():
+    """Build request headers for the OpenSea API"""
     headers = {
         "accept": "application/json",
         "User-Agent": "NFT-Sniper-Bot/1.0"
@@ -135,13 +142,32 @@ def fetch_metadata(token_id, contract_address):
     api_key = os.getenv("OPENSEA_API_KEY")
     if api_key:
         headers["X-API-KEY"] = api_key
+    return headers
+
+
+def parse_retry_after(value):
+    """Parse a Retry-After header value into seconds (None if missing/invalid)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return None
+
+
+def fetch_metadata(token_id, contract_address):
+    """Fetch NFT metadata from OpenSea API"""
+    url = opensea_url(f"/api/v2/asset/{contract_address}/{token_id}")
+    headers = opensea_headers()
 
     try:
-        response = requests.get(url, headers=headers, timeout=15)
+        response = http_session().get(url, headers=headers, timeout=15)
         
         if response.status_code == 200:
             data = response.json()
-            log_message(f"✅ Metadata fetched for token {token_id}")
+            if RECORDER.enabled:
+                RECORDER.record("metadata", {"contract": contract_address, "token_id": str(token_id), "data": data})
+            LOG.debug("✅ Metadata fetched for token %s", token_id)
             return data
         elif response.status_code == 404:
             log_message(f"⚠️ Token {token_id} not found on OpenSea")
@@ -164,30 +190,158 @@ def fetch_metadata(token_id, contract_address):
         return None
 
 
-def load_traits_cache():
-    """Load traits cache from file"""
+async def fetch_metadata_async(session, token_id, contract_address, scheduler=None, retries=3):
+    """Fetch NFT metadata from OpenSea API on an existing aiohttp session
+
+    When a PollScheduler is given, the request waits for rate budget first
+    and a 429 response is reported to it. Rate limited requests are retried
+    up to `retries` times once the cooldown has passed, since the listing
+    would otherwise go unscored.
+    """
+    for attempt in range(retries):
+        metadata = await _fetch_metadata_once(session, token_id, contract_address, scheduler)
+        if metadata is not RATE_LIMITED:
+            return metadata
+        if not scheduler:
+            await asyncio.sleep(2 ** attempt)
+    log_message(f"❌ Gave up fetching metadata for token {token_id} after {retries} rate limited attempts")
+    return None
+
+
+# Returned by _fetch_metadata_once for a 429, to be retried
+RATE_LIMITED = object()
+
+
+async def _fetch_metadata_once(session, token_id, contract_address, scheduler=None):
+    url = opensea_url(f"/api/v2/asset/{contract_address}/{token_id}")
+    timeout = aiohttp.ClientTimeout(total=15)
+
     try:
-        with open("traits_cache.json", "r", encoding='utf-8') as f:
-            cache = json.load(f)
-            log_message(f"✅ Loaded traits cache with {len(cache)} trait types")
-            return cache
-    except FileNotFoundError:
-        log_message("ℹ️ No traits cache found - starting fresh")
-        return {}
+        if scheduler:
+            await scheduler.acquire()
+        async with session.get(url, headers=opensea_headers(), timeout=timeout) as response:
+            if response.status == 200:
+                data = await response.json(content_type=None)
+                if RECORDER.enabled:
+                    RECORDER.record("metadata", {"contract": contract_address, "token_id": str(token_id), "data": data})
+                LOG.debug("✅ Metadata fetched for token %s", token_id)
+                return data
+            elif response.status == 404:
+                log_message(f"⚠️ Token {token_id} not found on OpenSea")
+                return None
+            elif response.status == 429:
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                if scheduler:
+                    scheduler.record_rate_limited(retry_after)
+                if retry_after is not None:
+                    log_message(f"⚠️ Rate limited by OpenSea API - pausing requests for {retry_after:.0f}s")
+                else:
+                    log_message("⚠️ Rate limited by OpenSea API - backing off")
+                return RATE_LIMITED
+            else:
+                log_message(f"❌ Metadata fetch failed: {response.status} - {await response.text()}")
+                return None
+
+    except asyncio.TimeoutError:
+        log_message(f"❌ Timeout fetching metadata for token {token_id}")
+        return None
+    except aiohttp.ClientError as e:
+        log_message(f"❌ Network error fetching metadata: {e}")
+        return None
     except json.JSONDecodeError as e:
-        log_message(f"❌ Error loading traits cache: {e}")
-        return {}
-    except Exception as e:
-        log_message(f"❌ Unexpected error loading traits cache: {e}")
-        return {}
+        log_message(f"❌ Invalid JSON response for token {token_id}: {e}")
+        return None
+
+
+TRAITS_CACHE_FILE = "traits_cache.json"
+TRAITS_CACHE_VERSION = 3
+
+
+def upgrade_traits_cache(cache):
+    """Bring a loaded traits cache to the current per-collection layout
+
+    Legacy files are a flat {trait_type: {value: count}} mapping; version 2
+    files describe a single collection.
+    """
+    if not cache:
+        return {"version": TRAITS_CACHE_VERSION, "collections": {}}
+    if "collections" in cache:
+        cache["version"] = TRAITS_CACHE_VERSION
+        return cache
+    if cache.get("version") == 2:
+        entry = {key: value for key, value in cache.items() if key not in ("version", "collection")}
+        return {"version": TRAITS_CACHE_VERSION, "collections": {cache.get("collection") or ANY_COLLECTION: entry}}
+    return {"version": TRAITS_CACHE_VERSION, "collections": {ANY_COLLECTION: {"traits": cache}}}
+
+
+def collection_cache(cache, collection_slug):
+    """Traits cache entry of one collection ({} if unknown)
+
+    A legacy entry without a collection ("*") is not used here; run_bot
+    moves it to the collection when only one is watched (see
+    TraitsCacheStore.adopt_legacy).
+    """
+    return cache.get("collections", {}).get(collection_slug) or {}
+
+
+def set_collection_cache(cache, collection_slug, entry):
+    """Store a collection's entry in the traits cache and return the cache"""
+    cache = upgrade_traits_cache(cache)
+    cache["collections"][collection_slug] = entry
+    return cache
+
+
+def open_traits_store():
+    """Traits cache store holding the saved cache with its journal replayed
+
+    The binary file is preferred; an old traits_cache.json is imported
+    when there is none. A damaged binary file is moved aside rather than
+    overwritten, so its data is not lost to the next save.
+    """
+    store = TraitsCacheStore(TRAITS_BINARY_FILE)
+    cache = None
+    try:
+        cache = upgrade_traits_cache(store.load_base())
+        log_message(f"✅ Loaded traits cache for {len(cache['collections'])} collections")
+    except FileNotFoundError:
+        pass
+    except (ValueError, OSError) as e:
+        log_message(f"❌ Error loading binary traits cache: {e}")
+        try:
+            os.replace(TRAITS_BINARY_FILE, f"{TRAITS_BINARY_FILE}.damaged")
+            log_message(f"⚠️ Kept the damaged file as {TRAITS_BINARY_FILE}.damaged")
+        except OSError:
+            pass
+    if cache is None:
+        try:
+            with open(TRAITS_CACHE_FILE, "r", encoding='utf-8') as f:
+                cache = upgrade_traits_cache(json.load(f))
+                log_message(f"✅ Imported traits cache for {len(cache['collections'])} collections from {TRAITS_CACHE_FILE}")
+        except FileNotFoundError:
+            log_message("ℹ️ No traits cache found - starting fresh")
+        except json.JSONDecodeError as e:
+            log_message(f"❌ Error loading traits cache: {e}")
+        except Exception as e:
+            log_message(f"❌ Unexpected error loading traits cache: {e}")
+    try:
+        store.open(cache or upgrade_traits_cache({}))
+    except OSError as e:
+        log_message(f"❌ Error reading traits cache journal: {e}")
+    if store.replayed:
+        log_message(f"✅ Replayed {store.replayed} traits cache updates")
+    return store
+
+
+def load_traits_cache():
+    """Load traits cache from file"""
+    return open_traits_store().cache
 
 
 def save_traits_cache(data):
-    """Save traits cache to file"""
+    """Save the whole traits cache (atomically) and clear the journal"""
     try:
-        with open("traits_cache.json", "w", encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
-        log_message(f"✅ Saved traits cache with {len(data)} trait types")
+        size = TraitsCacheStore(TRAITS_BINARY_FILE).compact(data)
+        log_message(f"✅ Saved traits cache for {len(data.get('collections', {}))} collections ({size} bytes)")
     except Exception as e:
         log_message(f"❌ Error saving traits cache: {e}")
 
@@ -218,34 +372,236 @@ def calculate_rarity_score(traits, traits_cache, total_supply):
     return round(score, 2)
 
 
+def metadata_traits(metadata):
+    """Traits list from an OpenSea asset/NFT response (None if absent)"""
+    if not metadata:
+        return None
+    if metadata.get("traits") is None and isinstance(metadata.get("nft"), dict):
+        return metadata["nft"].get("traits")
+    return metadata.get("traits")
+
+
+def traits_to_map(traits):
+    """Compact {trait_type: value} form of an OpenSea traits list"""
+    result = {}
+    for trait in traits or []:
+        trait_type = trait.get("trait_type")
+        value = trait.get("value")
+        if trait_type and value is not None and value != "":
+            result[str(trait_type)] = str(value)
+    return result
+
+
+def count_traits(tokens):
+    """Occurrence counts {trait_type: {value: count}} over {token_id: {trait_type: value}}"""
+    counts = {}
+    for traits in tokens.values():
+        for trait_type, value in traits.items():
+            values = counts.setdefault(trait_type, {})
+            values[value] = values.get(value, 0) + 1
+    return counts
+
+
+def write_json_atomic(path, data):
+    """Write JSON to a temp file and rename it over path"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def crawl_checkpoint_path(collection_slug):
+    return f"traits_crawl_{collection_slug}.json"
+
+
+def load_crawl_checkpoint(path, collection_slug):
+    """Resume state of an interrupted crawl, or a fresh one"""
+    try:
+        with open(path, "r", encoding='utf-8') as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("collection") == collection_slug:
+            return checkpoint
+    except FileNotFoundError:
+        pass
+    except (json.JSONDecodeError, OSError) as e:
+        log_message(f"⚠️ Ignoring unreadable crawl checkpoint {path}: {e}")
+    return {"collection": collection_slug, "next": None, "done": False, "tokens": {}, "failed": []}
+
+
+async def fetch_collection_stats_async(session, collection_slug, scheduler=None):
+    """Fetch collection stats from OpenSea (None on failure)"""
+    url = opensea_url(f"/api/v2/collection/{collection_slug}/stats")
+    try:
+        if scheduler:
+            await scheduler.acquire()
+        async with session.get(url, headers=opensea_headers(), timeout=aiohttp.ClientTimeout(total=15)) as response:
+            if response.status == 200:
+                data = await response.json(content_type=None)
+                if RECORDER.enabled:
+                    RECORDER.record("stats", {"collection": collection_slug, "data": data})
+                return data
+            if response.status == 429 and scheduler:
+                scheduler.record_rate_limited(parse_retry_after(response.headers.get("Retry-After")))
+            log_message(f"❌ Failed to get collection stats: {response.status}")
+            return None
+    except (asyncio.TimeoutError, aiohttp.ClientError, json.JSONDecodeError) as e:
+        log_message(f"❌ Error fetching collection stats: {e}")
+        return None
+
+
+async def fetch_collection_traits_async(session, collection_slug, scheduler=None):
+    """Fetch trait occurrence counts {trait_type: {value: count}} from OpenSea (None on failure)"""
+    url = opensea_url(f"/api/v2/traits/{collection_slug}")
+    try:
+        if scheduler:
+            await scheduler.acquire()
+        async with session.get(url, headers=opensea_headers(), timeout=aiohttp.ClientTimeout(total=15)) as response:
+            if response.status != 200:
+                if response.status == 429 and scheduler:
+                    scheduler.record_rate_limited(parse_retry_after(response.headers.get("Retry-After")))
+                log_message(f"❌ Failed to get collection traits: {response.status}")
+                return None
+            data = await response.json(content_type=None)
+        if RECORDER.enabled:
+            RECORDER.record("traits", {"collection": collection_slug, "data": data})
+    except (asyncio.TimeoutError, aiohttp.ClientError, json.JSONDecodeError) as e:
+        log_message(f"❌ Error fetching collection traits: {e}")
+        return None
+    counts = {}
+    for trait_type, values in (data.get("counts") or {}).items():
+        if isinstance(values, dict):
+            # Numeric traits come back as ranges rather than per-value counts
+            counts[trait_type] = {str(value): count for value, count in values.items() if isinstance(count, int)}
+    return counts
+
+
+async def fetch_collection_page_async(session, collection_slug, cursor=None, scheduler=None, retries=5):
+    """Fetch one page of a collection's NFTs, retrying on 429/5xx/timeouts"""
+    url = opensea_url(f"/api/v2/collection/{collection_slug}/nfts")
+    params = {"limit": 200}
+    if cursor:
+        params["next"] = cursor
+    for attempt in range(retries):
+        try:
+            if scheduler:
+                await scheduler.acquire()
+            async with session.get(url, params=params, headers=opensea_headers(),
+                                   timeout=aiohttp.ClientTimeout(total=30)) as response:
+                if response.status == 200:
+                    return await response.json(content_type=None)
+                if response.status == 429:
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                    if scheduler:
+                        scheduler.record_rate_limited(retry_after)
+                    else:
+                        await asyncio.sleep(retry_after or 2 ** attempt)
+                    continue
+                if response.status < 500:
+                    log_message(f"❌ Failed to list collection NFTs: {response.status} - {await response.text()}")
+                    return None
+                log_message(f"⚠️ OpenSea error {response.status} listing NFTs, retrying")
+        except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+            log_message(f"⚠️ Network error listing NFTs ({e}), retrying")
+        await asyncio.sleep(2 ** attempt)
+    return None
+
+
+async def crawl_collection(session, collection_slug, contract_address, scheduler=None, concurrency=None,
+                           checkpoint_path=None):
+    """Crawl every NFT of a collection and count its traits
+
+    The NFT list is paged sequentially; tokens whose list entry has no
+    traits get their metadata fetched concurrently, at most `concurrency`
+    at a time. Progress is checkpointed after every page so an interrupted
+    crawl resumes where it stopped. Returns the versioned traits cache, or
+    None if the crawl could not finish.
+    """
+    concurrency = concurrency or env_int("CRAWL_CONCURRENCY", 8, minimum=1)
+    checkpoint_path = checkpoint_path or crawl_checkpoint_path(collection_slug)
+    checkpoint = load_crawl_checkpoint(checkpoint_path, collection_slug)
+    tokens = checkpoint["tokens"]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    stats = await fetch_collection_stats_async(session, collection_slug, scheduler)
+    expected = ((stats or {}).get("stats") or {}).get("total_supply")
+    log_message(
+        f"🔧 Indexing traits for {collection_slug}: {len(tokens)} tokens done"
+        + (f" of ~{int(expected)}" if expected else "")
+    )
+
+    async def fetch_traits(token_id):
+        async with semaphore:
+            metadata = await fetch_metadata_async(session, token_id, contract_address, scheduler)
+        return metadata_traits(metadata)
+
+    async def fill(token_ids):
+        results = await asyncio.gather(*(fetch_traits(token_id) for token_id in token_ids))
+        failed = []
+        for token_id, traits in zip(token_ids, results):
+            if traits is None:
+                failed.append(token_id)
+            else:
+                tokens[token_id] = traits_to_map(traits)
+        return failed
+
+    while not checkpoint["done"]:
+        page = await fetch_collection_page_async(session, collection_slug, checkpoint["next"], scheduler)
+        if page is None:
+            log_message(f"❌ Traits crawl for {collection_slug} interrupted; it will resume from the checkpoint")
+            return None
+        missing = []
+        for nft in page.get("nfts", []):
+            token_id = str(nft.get("identifier"))
+            if token_id in tokens:
+                continue
+            if nft.get("traits") is not None:
+                tokens[token_id] = traits_to_map(nft["traits"])
+            else:
+                missing.append(token_id)
+        checkpoint["failed"].extend(await fill(missing))
+        checkpoint["next"] = page.get("next")
+        checkpoint["done"] = not checkpoint["next"]
+        write_json_atomic(checkpoint_path, checkpoint)
+        log_message(f"📥 Indexed {len(tokens)} tokens of {collection_slug}")
+
+    if checkpoint["failed"]:
+        log_message(f"🔁 Retrying {len(checkpoint['failed'])} tokens whose metadata failed")
+        checkpoint["failed"] = await fill([t for t in checkpoint["failed"] if t not in tokens])
+        write_json_atomic(checkpoint_path, checkpoint)
+        if checkpoint["failed"]:
+            log_message(f"⚠️ {len(checkpoint['failed'])} tokens have no traits and are left out of the counts")
+
+    now = int(datetime.now().timestamp())
+    entry = {
+        "contract_address": contract_address,
+        "total_supply": len(tokens),
+        "traits": count_traits(tokens),
+        "tokens": tokens,
+        "updated_at": now,
+        "supply_updated_at": now,
+    }
+    log_message(f"✅ Indexed {len(tokens)} tokens with {len(entry['traits'])} trait types for {collection_slug}")
+    try:
+        os.remove(checkpoint_path)
+    except OSError:
+        pass
+    return entry
+
+
 def build_traits_cache(collection_slug, contract_address):
-    """Build traits cache for a collection"""
+    """Build and save the traits cache for a collection (blocking)"""
     log_message(f"🔧 Building traits cache for collection: {collection_slug}")
-    
-    url = f"https://api.opensea.io/api/v2/collection/{collection_slug}/stats"
-    headers = {
-        "accept": "application/json",
-        "User-Agent": "NFT-Sniper-Bot/1.0"
-    }
-    
-    api_key = os.getenv("OPENSEA_API_KEY")
-    if api_key:
-        headers["X-API-KEY"] = api_key
-    
+
+    async def run():
+        async with create_session() as session:
+            return await crawl_collection(session, collection_slug, contract_address, scheduler=PollScheduler())
+
     try:
-        response = requests.get(url, headers=headers, timeout=15)
-        if response.status_code == 200:
-            stats = response.json()
-            total_supply = stats.get("stats", {}).get("total_supply", 0)
-            log_message(f"📊 Collection total supply: {total_supply}")
-            
-            # This is a simplified cache building - in a real implementation,
-            # you'd need to fetch all NFTs and analyze their traits
-            log_message("ℹ️ Traits cache building would require fetching all NFTs")
-            return {}
-        else:
-            log_message(f"❌ Failed to get collection stats: {response.status_code}")
-            return {}
+        entry = asyncio.run(run())
     except Exception as e:
         log_message(f"❌ Error building traits cache: {e}")
         return {}
+    if not entry:
+        return {}
+    save_traits_cache(set_collection_cache(load_traits_cache(), collection_slug, entry))
+    return entry